@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import gen_graphics
+
+# Renders a matrix of map variants in one run: the full map and one highlight
+# per route, at several sizes, in light and dark palettes.  The geometry is
+# compiled once (gen_graphics.LoadGeometry) and handed to each worker process
+# when it starts, so workers only draw and write.  Every output is written to a
+# temporary file next to its destination and renamed into place, so a reader
+# never sees a half written map.
+#
+#   python batch_render.py -o maps/ --sizes 1000x2000,250x500 --palettes light,dark
+#
+# A variant is {"name", "highlight": [line names] or null, "size": [w, h],
+# "palette"}; --matrix takes a JSON list of them instead of the generated set.
+
+PALETTES = {
+    # background, color of the lines not highlighted, station (outline, fill)
+    'light': {'background': None, 'muted': '#d0d0d0', 'station': ('black', 'white')},
+    'dark': {'background': '#101010', 'muted': '#404040', 'station': ('#101010', '#e0e0e0')},
+}
+SIZES = [(gen_graphics.WIDTH, gen_graphics.HEIGHT)]
+
+def Routes(geometry):
+    """ Returns {route: [line names]} for the enabled lines.  Lines named
+        '<route>_<part>' (e.g. pink_west) belong to <route>. """
+    routes = {}
+    for line in geometry['lines']:
+        if line['enabled']:
+            routes.setdefault(line['name'].split('_')[0], []).append(line['name'])
+    return routes
+
+def Variants(geometry, sizes=SIZES, palettes=('light',), routes=None):
+    """ Returns the full map plus one highlight per route (or per route in 'routes'),
+        for every size and palette """
+    found = Routes(geometry)
+    highlights = [('all', None)] + [(r, found[r]) for r in (routes or found)]
+    variants = []
+    for w, h in sizes:
+        for palette in palettes:
+            for name, lines in highlights:
+                variants.append({'name': '%s-%dx%d-%s' % (name, w, h, palette),
+                                 'highlight': lines, 'size': [w, h], 'palette': palette})
+    return variants
+
+def Draw(drawing, geometry, highlight=None, palette=PALETTES['light']):
+    """ Draws the map with every line but 'highlight' in the palette's muted color """
+    if palette['background'] is not None:
+        drawing.add(drawing.rect((0, 0), (gen_graphics.WIDTH, gen_graphics.HEIGHT),
+                                 fill=palette['background']))
+    if highlight is None:
+        gen_graphics.DrawMap(drawing, geometry=geometry)
+    else:
+        lines = [l for l in geometry['lines'] if l['enabled']]
+        for line in lines:
+            if line['name'] not in highlight:
+                gen_graphics.DrawLine(drawing, dict(line, color=palette['muted'], stations=[]))
+        # Highlighted line on top of the others
+        for line in lines:
+            if line['name'] in highlight:
+                gen_graphics.DrawLine(drawing, line)
+    gen_graphics.StationRegistry.For(drawing).Style(*palette['station'])
+
+_worker = {}
+
+def _Umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+def _Init(geometry, directory, backend):
+    # mkstemp() files are 0600, published maps get the usual permissions
+    _worker.update(geometry=geometry, directory=directory, backend=backend, mode=0o666 & ~_Umask())
+
+def Render(variant):
+    """ Renders one variant in a worker, returns its timing record """
+    start = time.perf_counter()
+    path = os.path.join(_worker['directory'], variant['name'] + '.svg')
+    fd, tmp = tempfile.mkstemp(dir=_worker['directory'], prefix='.' + variant['name'])
+    os.close(fd)
+    try:
+        dwg = gen_graphics.NewDrawing(tmp, backend=_worker['backend'], size=variant['size'])
+        Draw(dwg, _worker['geometry'], variant['highlight'], PALETTES[variant['palette']])
+        dwg.save()
+        os.chmod(tmp, _worker['mode'])
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return {'name': variant['name'], 'path': path, 'bytes': os.path.getsize(path),
+            'seconds': time.perf_counter() - start, 'pid': os.getpid()}
+
+def RenderAll(variants, directory, geometry=None, backend='fast', jobs=None):
+    """ Renders variants across 'jobs' processes (default: one per CPU, 1: in this
+        process).  Returns the timing records in variant order. """
+    geometry = geometry if geometry is not None else gen_graphics.LoadGeometry()
+    os.makedirs(directory, exist_ok=True)
+    if jobs == 1:
+        _Init(geometry, directory, backend)
+        return [Render(v) for v in variants]
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_Init,
+                             initargs=(geometry, directory, backend)) as pool:
+        return list(pool.map(Render, variants))
+
+def _Size(text):
+    w, h = text.lower().split('x')
+    return int(w), int(h)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render many map variants in parallel')
+    parser.add_argument('-o', '--output-dir', default='maps', help='(default: %(default)s)')
+    parser.add_argument('--sizes', default='%dx%d' % SIZES[0],
+                        help='comma separated WxH image sizes (default: %(default)s)')
+    parser.add_argument('--palettes', default='light,dark',
+                        help='comma separated, from: %s (default: %%(default)s)' % ', '.join(PALETTES))
+    parser.add_argument('--routes', help='comma separated routes to highlight (default: all)')
+    parser.add_argument('--matrix', help='JSON list of variants, replaces the generated set')
+    parser.add_argument('--backend', choices=['svgwrite', 'fast'], default='fast',
+                        help='SVG output backend (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, help='worker processes (default: one per CPU)')
+    parser.add_argument('--report', help='write the timing records to this JSON file')
+    args = parser.parse_args()
+
+    geometry = gen_graphics.LoadGeometry()
+    if args.matrix:
+        with open(args.matrix) as fh:
+            variants = json.load(fh)
+    else:
+        routes = args.routes.split(',') if args.routes else None
+        unknown = [r for r in routes or [] if r not in Routes(geometry)]
+        if unknown:
+            parser.error('unknown route(s) %s, choose from: %s'
+                         % (', '.join(unknown), ', '.join(Routes(geometry))))
+        variants = Variants(geometry, [_Size(s) for s in args.sizes.split(',')],
+                            args.palettes.split(','), routes)
+
+    start = time.perf_counter()
+    records = RenderAll(variants, args.output_dir, geometry, args.backend, args.jobs)
+    elapsed = time.perf_counter() - start
+
+    for r in records:
+        print('%-32s %8.1f ms %9d bytes' % (r['name'], r['seconds'] * 1000, r['bytes']))
+    total = sum(r['seconds'] for r in records)
+    print('%d variants in %.2fs (%.2fs of rendering)' % (len(records), elapsed, total), file=sys.stderr)
+    if args.report:
+        with open(args.report, 'w') as fh:
+            json.dump({'elapsed': elapsed, 'variants': records}, fh, indent=2)
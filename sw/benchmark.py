@@ -0,0 +1,287 @@
+import argparse
+import json
+import os
+import platform
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+import numpy as np
+import pandas as pd
+import gen_graphics
+import get_station_data
+import station_model
+
+# Offline benchmarks for the station export and the map renderer, run on
+# generated inputs so results are reproducible without the real feed:
+#
+#   extract/<mode>/x<scale>   station export from a synthetic GTFS feed shaped
+#                             like the CTA feed, 'scale' times the routes,
+#                             stops and trips.  Modes: tables (join on loaded
+#                             DataFrames), gtfs_kit (read the zip with
+#                             gk.read_feed, then export), lean (read the zip
+#                             with gtfs_stream, then export), compact (build a
+#                             station_model.StationModel).  Time and peak
+#                             traced memory.
+#   render/<backend>/<n>      the real map ('cta') or n generated lines with
+#                             STATIONS_PER_LINE stations each.  Compile time,
+#                             render time, element count and output bytes.
+#
+# Results are written as JSON along with the regression thresholds.  Given a
+# previous results file with --baseline, every shared metric is compared
+# using the baseline's thresholds and the run exits 1 on a regression:
+#
+#   python benchmark.py -o baseline.json
+#   python benchmark.py -o current.json --baseline baseline.json
+
+# Approximate shape of the CTA feed at scale 1
+RAIL_ROUTES = 8
+RAIL_STATIONS = 145
+RAIL_STATIONS_PER_ROUTE = 25
+RAIL_TRIPS = 1000      # per route
+BUS_ROUTES = 125
+BUS_STOPS = 10800
+BUS_STOPS_PER_ROUTE = 60
+BUS_TRIPS = 150        # per route
+
+STATIONS_PER_LINE = 20
+
+SCALES = [1, 10]
+LINES = ['cta', 10, 100, 400]
+EXTRACT_MODES = ['tables', 'gtfs_kit', 'lean', 'compact']
+BACKENDS = ['fast', 'svgwrite']
+
+# Largest allowed current/baseline ratio per metric.  Times under MIN_SECONDS
+# in both runs are too noisy to compare.
+THRESHOLDS = {'seconds': 1.25, 'compile_seconds': 1.25, 'peak_bytes': 1.15,
+              'elements': 1.0, 'bytes': 1.02}
+MIN_SECONDS = 0.01
+
+def SyntheticFeed(scale=1, seed=0):
+    """ Returns GTFS (routes, trips, stop_times, stops) DataFrames, rail routes
+        (route_type 1) through stations with two platforms each plus bus routes
+        (route_type 3) """
+    rng = np.random.default_rng(seed)
+    n_rail = max(1, int(round(RAIL_ROUTES * scale)))
+    n_bus = int(round(BUS_ROUTES * scale))
+    n_stations = max(RAIL_STATIONS_PER_ROUTE, int(round(RAIL_STATIONS * scale)))
+    n_bus_stops = max(BUS_STOPS_PER_ROUTE, int(round(BUS_STOPS * scale)))
+
+    station_ids = np.array(['4%05d' % i for i in range(n_stations)], dtype=object)
+    platform_ids = np.array(['3%05d' % i for i in range(2 * n_stations)], dtype=object)
+    bus_ids = np.array(['%d' % (100000 + i) for i in range(n_bus_stops)], dtype=object)
+    n_stops = n_stations * 3 + n_bus_stops
+    stops = pd.DataFrame({
+        'stop_id': np.concatenate([station_ids, platform_ids, bus_ids]),
+        'stop_name': ['Stop %d' % i for i in range(n_stops)],
+        'stop_lat': rng.uniform(41.64, 42.07, n_stops),
+        'stop_lon': rng.uniform(-87.94, -87.52, n_stops),
+        'location_type': np.concatenate([np.ones(n_stations, dtype=int), np.zeros(n_stops - n_stations, dtype=int)]),
+        'parent_station': np.concatenate([np.full(n_stations, None, dtype=object),
+                                          np.repeat(station_ids, 2),
+                                          np.full(n_bus_stops, None, dtype=object)]),
+    })
+
+    route_ids = ['R%d' % i for i in range(n_rail)] + ['B%d' % i for i in range(n_bus)]
+    routes = pd.DataFrame({
+        'route_id': route_ids,
+        'route_long_name': ['Route %s' % r for r in route_ids],
+        'route_type': [1] * n_rail + [3] * n_bus,
+        'route_color': ['%06x' % c for c in rng.integers(0, 1 << 24, n_rail + n_bus)],
+    })
+
+    trip_route, trip_stops = [], []
+    for i, rid in enumerate(route_ids):
+        if i < n_rail:
+            served = rng.choice(n_stations, RAIL_STATIONS_PER_ROUTE, replace=False)
+            # One platform per direction
+            pattern = [platform_ids[2 * served], platform_ids[2 * served[::-1] + 1]]
+            trips = RAIL_TRIPS
+        else:
+            served = rng.choice(n_bus_stops, BUS_STOPS_PER_ROUTE, replace=False)
+            pattern = [bus_ids[served], bus_ids[served[::-1]]]
+            trips = BUS_TRIPS
+        trip_route.append(np.full(trips, rid, dtype=object))
+        trip_stops.extend(pattern[t % 2] for t in range(trips))
+    trip_route = np.concatenate(trip_route)
+    trip_ids = np.array(['T%d' % i for i in range(len(trip_route))], dtype=object)
+    trips = pd.DataFrame({'route_id': trip_route, 'service_id': 'W', 'trip_id': trip_ids})
+
+    lengths = np.array([len(s) for s in trip_stops])
+    sequence = np.concatenate([np.arange(n) for n in lengths])
+    minutes = 5 * 60 + np.repeat(np.arange(len(trip_ids)) % 1000, lengths) + sequence * 2
+    labels = np.array(['%02d:%02d:00' % divmod(m, 60) for m in range(minutes.max() + 1)], dtype=object)
+    clock = labels[minutes]
+    stop_times = pd.DataFrame({
+        'trip_id': np.repeat(trip_ids, lengths),
+        'arrival_time': clock,
+        'departure_time': clock,
+        'stop_id': np.concatenate(trip_stops),
+        'stop_sequence': sequence + 1,
+    })
+    return routes, trips, stop_times, stops
+
+def WriteFeed(tables, path):
+    """ Writes (routes, trips, stop_times, stops) as a GTFS zip """
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, df in zip(['routes', 'trips', 'stop_times', 'stops'], tables):
+            archive.writestr(name + '.txt', df.to_csv(index=False))
+
+def SyntheticLines(count, stations=STATIONS_PER_LINE, seed=0):
+    """ Returns a line spec (lines.json format) of 'count' staircase shaped lines
+        side by side across the address range, each with 'stations' stations """
+    rng = np.random.default_rng(seed)
+    lines = []
+    for i in range(count):
+        # Evenly spaced, so no two lines share a station
+        east = -gen_graphics.MAX_W_ADDR + i * (gen_graphics.MAX_W_ADDR + gen_graphics.MAX_E_ADDR) // count
+        north = -gen_graphics.MAX_S_ADDR + int(rng.integers(0, 400))
+        steps = []
+        for s in range(stations):
+            steps.append(['blocks', [0, 800]])
+            steps.append(['station', [0, 0]])
+            if s % 4 == 3:
+                bend = 90 if s % 8 == 3 else -90
+                steps += [['turn', bend], ['blocks', [200 if bend > 0 else -200, 0]], ['turn', -bend]]
+        lines.append({'name': 'line%d' % i, 'color': '#%06x' % int(rng.integers(0, 1 << 24)),
+                      'start': [east, north], 'heading': 270, 'steps': steps})
+    return {'entry': {}, 'el_stations': {}, 'lines': lines}
+
+def _Best(fn, repeat):
+    """ Returns (result, fastest wall time) of 'repeat' calls """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+def _Peak(fn):
+    """ Returns the peak traced allocation of one call, in bytes """
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def BenchExtract(scales=SCALES, modes=EXTRACT_MODES, repeat=3):
+    """ Returns {case name: metrics} for the station export """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in scales:
+            tables = SyntheticFeed(scale)
+            path = os.path.join(tmp, 'feed_x%s.zip' % scale)
+            if 'lean' in modes or 'gtfs_kit' in modes:
+                WriteFeed(tables, path)
+            runs = {
+                'tables': lambda: get_station_data.extract_stations(*tables),
+                'gtfs_kit': lambda: get_station_data.extract_stations(*get_station_data.read_tables(path)),
+                'lean': lambda: get_station_data.extract_stations(*get_station_data.read_tables(path, lean=True)),
+                'compact': lambda: station_model.StationModel.from_tables(*tables),
+            }
+            for mode in modes:
+                result, seconds = _Best(runs[mode], repeat)
+                results['extract/%s/x%s' % (mode, scale)] = {
+                    'seconds': seconds,
+                    'peak_bytes': _Peak(runs[mode]),
+                    'stop_times': len(tables[2]),
+                    'stations': len(result) if mode == 'compact' else
+                                len({s['stop_id'] for r in result for s in r['stations']}),
+                }
+    return results
+
+def BenchRender(lines=LINES, backends=BACKENDS, repeat=3):
+    """ Returns {case name: metrics} for compiling and rendering line geometry """
+    results = {}
+    for count in lines:
+        if count == 'cta':
+            with open(gen_graphics.LINES_FILE) as fh:
+                spec = json.load(fh)
+        else:
+            spec = SyntheticLines(int(count))
+        geometry, compile_seconds = _Best(lambda: gen_graphics.CompileGeometry(spec), repeat)
+        stations = sum(len(l['stations']) for l in geometry['lines'] if l['enabled'])
+        for backend in backends:
+            def render():
+                dwg = gen_graphics.NewDrawing('benchmark.svg', backend=backend)
+                gen_graphics.DrawLines(dwg, geometry=geometry)
+                return dwg.tostring()
+            svg, seconds = _Best(render, repeat)
+            results['render/%s/%s' % (backend, count)] = {
+                'seconds': seconds,
+                'compile_seconds': compile_seconds,
+                'lines': sum(1 for l in geometry['lines'] if l['enabled']),
+                'stations': stations,
+                'elements': len(re.findall(r'<[A-Za-z]', svg)),
+                'bytes': len(svg.encode()),
+            }
+    return results
+
+def Compare(results, baseline):
+    """ Returns a list of regression messages against a baseline results file """
+    thresholds = baseline.get('thresholds', THRESHOLDS)
+    min_seconds = baseline.get('min_seconds', MIN_SECONDS)
+    regressions = []
+    for case, metrics in sorted(results.items()):
+        before = baseline['results'].get(case)
+        if before is None:
+            continue
+        for metric, limit in thresholds.items():
+            if metric not in metrics or metric not in before:
+                continue
+            old, new = before[metric], metrics[metric]
+            if metric.endswith('seconds') and max(old, new) < min_seconds:
+                continue
+            if new > old * limit:
+                regressions.append('%s %s: %.4g -> %.4g (x%.2f, limit x%.2f)'
+                                   % (case, metric, old, new, new / old if old else float('inf'), limit))
+    return regressions
+
+def _List(text, convert=str):
+    return [convert(v) for v in text.split(',')] if text else []
+
+def _Scale(text):
+    return float(text) if '.' in text else int(text)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the station export and map rendering')
+    parser.add_argument('-o', '--output', default='benchmark.json', help='results file (default: %(default)s)')
+    parser.add_argument('--baseline', help='previous results file to check for regressions')
+    parser.add_argument('--scales', default=','.join(map(str, SCALES)),
+                        help='synthetic feed sizes, relative to CTA (default: %(default)s)')
+    parser.add_argument('--extract-modes', default=','.join(EXTRACT_MODES), help='(default: %(default)s)')
+    parser.add_argument('--lines', default=','.join(map(str, LINES)),
+                        help="line counts to render, 'cta' is lines.json (default: %(default)s)")
+    parser.add_argument('--backends', default=','.join(BACKENDS), help='(default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case, the fastest counts (default: %(default)s)')
+    args = parser.parse_args()
+
+    results = {}
+    results.update(BenchExtract(_List(args.scales, _Scale), _List(args.extract_modes), args.repeat))
+    results.update(BenchRender(_List(args.lines), _List(args.backends), args.repeat))
+    for case, metrics in results.items():
+        print('%-28s %s' % (case, ' '.join('%s=%.4g' % kv for kv in metrics.items())))
+
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'thresholds': THRESHOLDS,
+        'min_seconds': MIN_SECONDS,
+        'results': results,
+    }
+    with open(args.output, 'w') as fh:
+        json.dump(report, fh, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            regressions = Compare(results, json.load(fh))
+        for r in regressions:
+            print('REGRESSION ' + r, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,75 @@
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+from aiohttp import web
+
+# Local stand-in for the Train Tracker positions API.  Replays responses saved
+# with train_tracker.py --record, laid out as <dir>/<route>/*.json, cycling
+# through each route's files in name order.  Supports ETag / If-None-Match so
+# conditional requests get 304s, and can add latency and errors to exercise
+# the poller's backoff.
+
+STATS = web.AppKey('stats', dict)
+
+EMPTY = b'{"ctatt": {"tmst": null, "errCd": "0", "errNm": null, "route": []}}'
+
+class Recordings:
+    """ Recorded response bodies per route, served round robin """
+    def __init__(self, path):
+        self._bodies = {}
+        self._next = {}
+        if path is not None:
+            for route in sorted(os.listdir(path)):
+                folder = os.path.join(path, route)
+                if not os.path.isdir(folder):
+                    continue
+                bodies = []
+                for name in sorted(os.listdir(folder)):
+                    with open(os.path.join(folder, name), 'rb') as fh:
+                        bodies.append(fh.read())
+                if bodies:
+                    self._bodies[route] = bodies
+
+    def Next(self, route):
+        bodies = self._bodies.get(route)
+        if not bodies:
+            return EMPTY
+        i = self._next.get(route, 0)
+        self._next[route] = (i + 1) % len(bodies)
+        return bodies[i]
+
+def MakeApp(recordings, latency=0.0, error_rate=0.0):
+    """ Returns the aiohttp application serving /api/1.0/ttpositions.aspx """
+    app = web.Application()
+    # Set up before startup and only mutated in place while serving
+    app[STATS] = {'requests': 0}
+
+    async def positions(request):
+        app[STATS]['requests'] += 1
+        if latency:
+            await asyncio.sleep(latency)
+        if random.random() < error_rate:
+            return web.Response(status=503, text='injected error')
+        if 'key' not in request.query:
+            return web.json_response({'ctatt': {'errCd': '101', 'errNm': 'Invalid API key'}})
+        body = recordings.Next(request.query.get('rt', ''))
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(body=body, content_type='application/json', headers={'ETag': etag})
+
+    app.router.add_get('/api/1.0/ttpositions.aspx', positions)
+    return app
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve recorded Train Tracker responses')
+    parser.add_argument('recordings', nargs='?', help='directory written by train_tracker.py --record')
+    parser.add_argument('--port', type=int, default=8080, help='(default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered 503')
+    args = parser.parse_args()
+
+    web.run_app(MakeApp(Recordings(args.recordings), args.latency, args.error_rate),
+                host='127.0.0.1', port=args.port)
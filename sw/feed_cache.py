@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+# On-disk cache of the parsed rail subset of a GTFS feed and its station
+# export.  Entries are keyed by the SHA-256 of the feed zip, the loader that
+# parsed it and CACHE_VERSION (see feed_key()), so a new feed or new code is a
+# new entry and stale ones are never read.  Each entry is a directory:
+#   <root>/<key>/routes.npz, trips.npz, stop_times.npz, stops.npz
+#   <root>/<key>/stations.json
+# Tables are stored one array per column (uncompressed .npz) so loading is a
+# straight read with no CSV parsing.  The least recently used entries are
+# evicted once the cache grows beyond max_bytes.
+
+CACHE_DIR = '.feed_cache'
+MAX_BYTES = 256 * 1024 * 1024
+TABLES = ['routes', 'trips', 'stop_times', 'stops']
+# Bump when what is cached changes: the tables or columns kept, the .npz
+# layout (save_table/load_table) or the station export (extract_stations)
+CACHE_VERSION = 1
+
+def feed_hash(path, blocksize=1 << 20):
+  """ Returns the hex SHA-256 of a file's contents """
+  digest = hashlib.sha256()
+  with open(path, 'rb') as fh:
+    for block in iter(lambda: fh.read(blocksize), b''):
+      digest.update(block)
+  return digest.hexdigest()
+
+def feed_key(path, loader):
+  """ Returns the cache key for the feed at 'path' parsed by 'loader' """
+  return '%s-%s-v%d' % (feed_hash(path), loader, CACHE_VERSION)
+
+def save_table(df, path):
+  """ Writes a DataFrame as one array per column.  Object (string) columns
+      are stored as fixed width unicode and nullable integer columns (e.g.
+      gtfs_kit's Int32) as int64 plus their dtype name, both with a separate
+      missing-value mask """
+  arrays = {'columns': np.array(df.columns, dtype=str)}
+  for i, name in enumerate(df.columns):
+    col = df[name]
+    if not pd.api.types.is_numeric_dtype(col):
+      arrays['na%d' % i] = col.isna().to_numpy()
+      arrays['c%d' % i] = col.fillna('').astype(str).to_numpy(dtype=str)
+    elif pd.api.types.is_extension_array_dtype(col) and pd.api.types.is_integer_dtype(col):
+      arrays['na%d' % i] = col.isna().to_numpy()
+      arrays['c%d' % i] = col.fillna(0).to_numpy(dtype=np.int64)
+      arrays['dt%d' % i] = np.array(str(col.dtype))
+    else:
+      arrays['c%d' % i] = col.to_numpy()
+  with open(path, 'wb') as fh:
+    np.savez(fh, **arrays)
+
+def load_table(path):
+  """ Reads a DataFrame written by save_table() """
+  with np.load(path, allow_pickle=False) as data:
+    data = dict(data.items())
+  columns = {}
+  for i, name in enumerate(data['columns']):
+    values = data['c%d' % i]
+    if 'dt%d' % i in data:
+      values = pd.array(values, dtype=str(data['dt%d' % i]))
+      values[data['na%d' % i]] = pd.NA
+    elif 'na%d' % i in data:
+      values = pd.Series(values, dtype=object)
+      values[data['na%d' % i]] = None
+    columns[str(name)] = values
+  return pd.DataFrame(columns)
+
+class FeedCache:
+  """ Content addressed cache of parsed GTFS tables and station exports """
+  def __init__(self, root=CACHE_DIR, max_bytes=MAX_BYTES):
+    self._root = root
+    self._max_bytes = max_bytes
+
+  def _entry(self, key):
+    return os.path.join(self._root, key)
+
+  def _touch(self, key):
+    """ Marks an entry as recently used """
+    os.utime(self._entry(key))
+
+  def _store(self, key, name, write):
+    """ Writes one file of an entry atomically via a temp file + rename """
+    entry = self._entry(key)
+    os.makedirs(entry, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=entry, prefix='.' + name)
+    os.close(fd)
+    try:
+      write(tmp)
+      os.replace(tmp, os.path.join(entry, name))
+    except BaseException:
+      os.unlink(tmp)
+      raise
+
+  def tables(self, key, loader):
+    """ Returns the (routes, trips, stop_times, stops) tables for 'key',
+        calling loader() and storing its result on a miss """
+    entry = self._entry(key)
+    files = [os.path.join(entry, t + '.npz') for t in TABLES]
+    if all(os.path.exists(f) for f in files):
+      self._touch(key)
+      return tuple(load_table(f) for f in files)
+
+    tables = loader()
+    for name, df in zip(TABLES, tables):
+      self._store(key, name + '.npz', lambda tmp, df=df: save_table(df, tmp))
+    self.evict(keep=key)
+    return tables
+
+  def stations(self, key, build):
+    """ Returns the station export for 'key', calling build() and storing
+        its result on a miss """
+    path = os.path.join(self._entry(key), 'stations.json')
+    if os.path.exists(path):
+      self._touch(key)
+      with open(path) as fh:
+        return json.load(fh)
+
+    stationdata = build()
+    def write(tmp):
+      with open(tmp, 'w') as fh:
+        json.dump(stationdata, fh)
+    self._store(key, 'stations.json', write)
+    self.evict(keep=key)
+    return stationdata
+
+  def evict(self, keep=None):
+    """ Removes least recently used entries until the cache fits in
+        max_bytes.  The entry 'keep' is never removed """
+    if not os.path.isdir(self._root):
+      return
+    entries = []
+    total = 0
+    for key in os.listdir(self._root):
+      entry = self._entry(key)
+      if not os.path.isdir(entry):
+        continue
+      size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+      entries.append((os.path.getmtime(entry), key, size))
+      total += size
+    for _, key, size in sorted(entries):
+      if total <= self._max_bytes:
+        break
+      if key == keep:
+        continue
+      shutil.rmtree(self._entry(key), ignore_errors=True)
+      total -= size
@@ -0,0 +1,156 @@
+import numpy as np
+import gen_graphics
+from track import ARC
+
+# Renders the compiled line geometry straight into a numpy RGB framebuffer
+# for LED matrices and small displays, skipping SVG entirely.  The static map
+# is rasterized once with anti-aliased lines, arcs and station markers.
+# Lookup tables from station marker id, and from distance along each track,
+# to pixel (or LED) index are precomputed, so a live frame is:
+#
+#   frame = base.copy()
+#   frame.reshape(-1, 3)[luts.Track('red', 0, distances)] = (255, 255, 255)
+
+BACKGROUND = (0, 0, 0)
+STATION_FILL = (255, 255, 255)
+STATION_OUTLINE = (0, 0, 0)
+
+def _rgb(color):
+    """ '#rrggbb' -> array of floats """
+    return np.array([int(color[i:i+2], 16) for i in (1, 3, 5)], dtype=np.float32)
+
+class Rasterizer:
+    """ Draws compiled geometry (gen_graphics.LoadGeometry()) at width x height pixels """
+    def __init__(self, width, height, geometry=None):
+        self.width = width
+        self.height = height
+        self.geometry = geometry if geometry is not None else gen_graphics.LoadGeometry()
+        # View coordinates (WIDTH x HEIGHT) -> pixels, keeping the aspect ratio
+        self.scale = min(width / gen_graphics.WIDTH, height / gen_graphics.HEIGHT)
+        self._tracks = {line['name']: gen_graphics.LineTracks(line) for line in self.geometry['lines']}
+
+    def ToPixels(self, points):
+        return np.asarray(points, dtype=float) * self.scale
+
+    def _Coverage(self, segments, half_width, coverage):
+        """ Accumulates (max) anti-aliased coverage of thick segments, given as an
+            (N, 2, 2) array of pixel end points, into 'coverage' """
+        pad = half_width + 1
+        for (x0, y0), (x1, y1) in segments:
+            left = max(int(np.floor(min(x0, x1) - pad)), 0)
+            right = min(int(np.ceil(max(x0, x1) + pad)) + 1, self.width)
+            top = max(int(np.floor(min(y0, y1) - pad)), 0)
+            bottom = min(int(np.ceil(max(y0, y1) + pad)) + 1, self.height)
+            if left >= right or top >= bottom:
+                continue
+            px, py = np.meshgrid(np.arange(left, right) + 0.5, np.arange(top, bottom) + 0.5)
+            dx, dy = x1 - x0, y1 - y0
+            length2 = dx * dx + dy * dy
+            t = np.clip(((px - x0) * dx + (py - y0) * dy) / length2, 0, 1) if length2 else 0.0
+            dist = np.hypot(x0 + t * dx - px, y0 + t * dy - py)
+            cover = np.clip(half_width + 0.5 - dist, 0, 1)
+            region = coverage[top:bottom, left:right]
+            np.maximum(region, cover, out=region)
+
+    def _Blend(self, frame, coverage, color):
+        a = coverage[..., None]
+        frame *= 1 - a
+        frame += a * color
+
+    def TrackPolyline(self, track, step=1.0):
+        """ Pixel polyline along a track.Track.  Straight pieces are kept whole, arcs are
+            sampled every 'step' pixels. """
+        d, start = [], 0.0
+        for piece in track.ToList():
+            if piece[0] == ARC:
+                length = piece[3] * np.radians(abs(piece[5]))
+                d.extend(start + np.arange(0.0, length * self.scale, step) / self.scale)
+            else:
+                length = np.hypot(piece[3] - piece[1], piece[4] - piece[2])
+                d.append(start)
+            start += length
+        d.append(track.Length())
+        points, _ = track.AtMany(d)
+        return self.ToPixels(points)
+
+    def Render(self, names=None):
+        """ Returns a (height, width, 3) uint8 frame of the enabled lines (or 'names') """
+        frame = np.empty((self.height, self.width, 3), dtype=np.float32)
+        frame[:] = BACKGROUND
+        lines = [l for l in self.geometry['lines']
+                 if (names is None and l['enabled']) or (names is not None and l['name'] in names)]
+        for line in lines:
+            coverage = np.zeros((self.height, self.width), dtype=np.float32)
+            for track in self._tracks[line['name']]:
+                poly = self.TrackPolyline(track)
+                self._Coverage(np.stack([poly[:-1], poly[1:]], axis=1),
+                               max(line['thick'] * self.scale / 2, 0.5), coverage)
+            self._Blend(frame, coverage, _rgb(line['color']))
+
+        radius = max(gen_graphics.STATION_RADIUS * gen_graphics.SCALE * self.scale, 0.5)
+        outline = max(gen_graphics.STATION_THICK * self.scale, 0.5)
+        spans = np.array(list(self.StationSpans(lines).values())).reshape(-1, 2, 2)
+        for r, color in ((radius + outline / 2, STATION_OUTLINE), (radius - outline / 2, STATION_FILL)):
+            coverage = np.zeros((self.height, self.width), dtype=np.float32)
+            self._Coverage(spans, r, coverage)
+            self._Blend(frame, coverage, np.array(color, dtype=np.float32))
+        return np.rint(frame).astype(np.uint8)
+
+    def StationSpans(self, lines=None):
+        """ Returns {station marker id: (2, 2) array of pixel end points}.  A station
+            shared by several lines spans all of them, like its SVG marker. """
+        lines = lines if lines is not None else self.geometry['lines']
+        points = {}
+        for line in lines:
+            for s in line['stations']:
+                points.setdefault(gen_graphics.StationId(s), []).append(s[1])
+        return {eid: self.ToPixels([min(p), max(p)]) for eid, p in points.items()}
+
+    def StationCenters(self, lines=None):
+        """ Returns {station marker id: pixel center} """
+        return {eid: span.mean(axis=0) for eid, span in self.StationSpans(lines).items()}
+
+    def LookupTables(self, led_order=None):
+        """ Precomputed pixel indexes, see PixelLUT """
+        return PixelLUT(self, led_order)
+
+def SerpentineOrder(width, height):
+    """ LED index of every pixel for a matrix wired in rows that alternate direction """
+    index = np.arange(width * height).reshape(height, width)
+    index[1::2] = index[1::2, ::-1]
+    return index.ravel()
+
+class PixelLUT:
+    """ Station marker id -> index, and distance along a line's track -> index.
+        Indexes are into frame.reshape(-1, 3), or into the LED chain when led_order
+        (LED index per pixel, e.g. SerpentineOrder()) is given. """
+    def __init__(self, raster, led_order=None, step=0.5):
+        self._width = raster.width
+        self._height = raster.height
+        self._order = led_order
+        self._step = step  # view units between track table entries
+        self.stations = {eid: self._Index(c[None, :])[0] for eid, c in raster.StationCenters().items()}
+        self._tracks = {}
+        for name, tracks in raster._tracks.items():
+            tables = []
+            for track in tracks:
+                d = np.arange(0.0, track.Length() + step, step)
+                points, _ = track.AtMany(d)
+                tables.append(self._Index(raster.ToPixels(points)))
+            self._tracks[name] = tables
+
+    def _Index(self, pixels):
+        col = np.clip(pixels[:, 0].astype(int), 0, self._width - 1)
+        row = np.clip(pixels[:, 1].astype(int), 0, self._height - 1)
+        index = row * self._width + col
+        return self._order[index] if self._order is not None else index
+
+    def Station(self, ids):
+        """ Indexes for a list of station marker ids """
+        return np.array([self.stations[i] for i in ids], dtype=int)
+
+    def Track(self, name, branch, distances):
+        """ Indexes for an array of distances (view units) along a line's branch """
+        table = self._tracks[name][branch]
+        slot = np.clip(np.rint(np.asarray(distances) / self._step).astype(int), 0, len(table) - 1)
+        return table[slot]
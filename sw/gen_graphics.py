@@ -1,5 +1,17 @@
+import argparse
+import copy
+import functools
+import hashlib
+import json
+import logging
 import math
+import os
+import sys
+import time
+import numpy as np
 import svgwrite
+import svgfast
+import track
 
 # Line colors taken from CTA website
 REDCOLOR="#c60c30"
@@ -25,6 +37,10 @@ LINE_THICK=20
 STATION_THICK=2
 STATION_RADIUS=70
 ARCH_R=200
+STATION_SNAP=10 # station markers whose addresses snap to the same point are drawn once
+
+# Line geometry data, see LoadGeometry()
+LINES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lines.json')
 
 # Scaling needed to fit all addresses into image
 SCALE = min(WIDTH / (MAX_W_ADDR + MAX_E_ADDR), HEIGHT / (MAX_N_ADDR + MAX_S_ADDR))
@@ -40,49 +56,251 @@ SCALE = min(WIDTH / (MAX_W_ADDR + MAX_E_ADDR), HEIGHT / (MAX_N_ADDR + MAX_S_ADDR
 #    blocks = tuple of relative distance in Chicago addresses.  1 block is 100 addresses; [East, North]
 #    coords = tuple of view coordinates [x,y]
 
+log = logging.getLogger('ctamap.graphics')
+
+class AddressTransform:
+    """ Address <-> view coordinate mapping shared by all lines: x = cx + scale * East,
+        y = cy - scale * North.  The array methods convert any number of points, shape
+        (N, 2), in one call; the single point methods avoid numpy overhead for the drawing
+        code. """
+    def __init__(self, scale=SCALE, center=(MAX_W_ADDR*SCALE, MAX_S_ADDR*SCALE)):
+        self._scale = np.array([scale, -scale])
+        self._center = np.array(center, dtype=float)
+        self._sx, self._sy = float(scale), float(-scale)
+        self._cx, self._cy = float(center[0]), float(center[1])
+
+    def ToView(self, addresses):
+        """ Array of addresses -> array of view coordinates """
+        return self._center + np.asarray(addresses, dtype=float) * self._scale
+
+    def ToAddress(self, coords):
+        """ Array of view coordinates -> array of addresses """
+        return (np.asarray(coords, dtype=float) - self._center) / self._scale
+
+    def ToDistance(self, blocks):
+        """ Array of address offsets -> array of view offsets """
+        return np.asarray(blocks, dtype=float) * self._scale
+
+    def ToBlocks(self, distances):
+        """ Array of view offsets -> array of address offsets """
+        return np.asarray(distances, dtype=float) / self._scale
+
+    def Point(self, addr):
+        return [self._cx + addr[0] * self._sx, self._cy + addr[1] * self._sy]
+
+    def Address(self, coord):
+        return [(coord[0] - self._cx) / self._sx, (coord[1] - self._cy) / self._sy]
+
+    def Distance(self, blocks):
+        return [blocks[0] * self._sx, blocks[1] * self._sy]
+
+    def Blocks(self, distance):
+        return [distance[0] / self._sx, distance[1] / self._sy]
+
+    def Length(self, value):
+        """ Address length (e.g. a radius) -> view length """
+        return value * self._sx
+
+# Transform for the map WIDTH x HEIGHT view, used by every TrainLine unless given another
+VIEW = AddressTransform()
+
+class RenderStats:
+    """ Counters per (phase, line, drawing call): number of calls, elements emitted
+        (path segments and new station markers) and time spent.  Phase 'compile' is
+        TrainLine calls while compiling geometry, 'draw' is adding lines to a drawing. """
+    def __init__(self):
+        self._counters = {}
+
+    def Add(self, line, call, elements, seconds, phase='draw'):
+        counter = self._counters.setdefault((phase, line, call), [0, 0, 0.0])
+        counter[0] += 1
+        counter[1] += elements
+        counter[2] += seconds
+
+    def Report(self):
+        """ Returns a list of dicts, one per (phase, line, call) """
+        return [{'phase': phase, 'line': line, 'call': call, 'calls': c[0], 'elements': c[1], 'seconds': c[2]}
+                for (phase, line, call), c in sorted(self._counters.items())]
+
+    def Format(self):
+        """ Returns the report as a text table """
+        lines = ["{:<8} {:<12} {:<16} {:>6} {:>8} {:>10}".format('phase', 'line', 'call', 'calls', 'elements', 'ms')]
+        for r in self.Report():
+            lines.append("{:<8} {:<12} {:<16} {:>6} {:>8} {:>10.3f}".format(
+                r['phase'], r['line'], r['call'], r['calls'], r['elements'], r['seconds']*1000))
+        return "\n".join(lines)
+
+_stats = None
+_compiling = False # TrainLine calls are being made by CompileGeometry()
+
+def EnableStats():
+    """ Starts collecting RenderStats for all drawing calls and returns them """
+    global _stats
+    _stats = RenderStats()
+    return _stats
+
+def DisableStats():
+    global _stats
+    _stats = None
+
+def _timed(method):
+    """ Records a TrainLine drawing call in the active RenderStats, if any """
+    @functools.wraps(method)
+    def timed(self, *args, **kwargs):
+        stats = _stats
+        if stats is None:
+            return method(self, *args, **kwargs)
+        before = self._emitted
+        start = time.perf_counter()
+        result = method(self, *args, **kwargs)
+        stats.Add(self._name, method.__name__, self._emitted - before, time.perf_counter() - start,
+                  'compile' if _compiling else 'draw')
+        return result
+    return timed
+
+class StationRegistry:
+    """ Drawing-wide set of station markers.  Each station is emitted once, no matter how
+        many lines pass through it.  Unnamed stations are keyed by their snapped address and
+        drawn as a <use> of one shared marker definition.  Named stations (lines.json
+        el_stations) are shared by every line placing one with that name, usually in its
+        own lane, and drawn as a single rounded rect spanning all of them. """
+    def __init__(self, drawing, transform=VIEW):
+        self._dwg = drawing
+        self._radius = transform.Length(STATION_RADIUS)
+        self._marker = drawing.defs.add(drawing.circle((0,0), r=self._radius, id='station'))
+        self._group = drawing.add(drawing.g(stroke='black', stroke_width=STATION_THICK, fill='white', fill_opacity=100 ))
+        self._stations = {}
+        self._points = {}   # named station -> view coords of every line through it
+        self._located = {}  # key -> (snapped address, view coords) where first added
+
+    @staticmethod
+    def For(drawing, transform=VIEW):
+        """ Returns the registry for 'drawing', creating it on first use with markers
+            sized for 'transform' """
+        registry = getattr(drawing, '_station_registry', None)
+        if registry is None:
+            registry = StationRegistry(drawing, transform)
+            drawing._station_registry = registry
+        return registry
+
+    def Key(self, address, name=None):
+        """ Returns 'name', or for unnamed stations the address snapped to the station grid """
+        if name is not None:
+            return name
+        return (int(round(address[0] / STATION_SNAP)) * STATION_SNAP,
+                int(round(address[1] / STATION_SNAP)) * STATION_SNAP)
+
+    @staticmethod
+    def Id(key):
+        """ Element id of the station with registry key 'key' """
+        return 'station_%s' % key if isinstance(key, str) else 'station_%d_%d' % tuple(key)
+
+    def _Span(self, station, points):
+        """ Resizes a named station's rect to cover every point, with round ends """
+        r = self._radius
+        x = [p[0] for p in points]
+        y = [p[1] for p in points]
+        station['x'], station['y'] = min(x) - r, min(y) - r
+        station['width'], station['height'] = max(x) - min(x) + 2*r, max(y) - min(y) + 2*r
+
+    def Add(self, address, coords, name=None):
+        """ Registers a station at 'address' (drawn at view 'coords') and returns its element """
+        key = self.Key(address, name)
+        station = self._stations.get(key)
+        self._located.setdefault(key, (list(self.Key(address)), list(coords)))
+        if name is not None and station is not None:
+            self._points[key].append(coords)
+            self._Span(station, self._points[key])
+        elif name is not None:
+            r = self._radius
+            station = self._group.add(self._dwg.rect((0,0), (0,0), rx=r, ry=r, id=self.Id(key)))
+            self._points[key] = [coords]
+            self._Span(station, self._points[key])
+            self._stations[key] = station
+        elif station is None:
+            station = self._group.add(self._dwg.use(self._marker, insert=coords, id=self.Id(key)))
+            self._stations[key] = station
+        self.Raise()
+        return station
+
+    def Raise(self):
+        """ Moves the station markers above every line drawn so far """
+        if self._dwg.elements[-1] is not self._group:
+            self._dwg.elements.remove(self._group)
+            self._dwg.elements.append(self._group)
+
+    def Stations(self):
+        """ Returns {key: element} for every registered station, see Key() """
+        return self._stations
+
+    def Located(self):
+        """ Returns {key: (snapped address, view coords)} of where each station was first added """
+        return self._located
+
+    def Style(self, stroke, fill):
+        """ Sets the outline and fill color of every station marker """
+        self._group['stroke'] = stroke
+        self._group['fill'] = fill
+
 class TrainLine:
     """ Class for drawing CTA line maps."""
-    def __init__(self, drawing, start_address, color='#b0b0b0', thick=LINE_THICK):
-        """ start_address is tuple with initial location in city address coordinates"""
+    def __init__(self, drawing, start_address, color='#b0b0b0', thick=LINE_THICK, name=None, heading=None,
+                 transform=VIEW):
+        """ start_address is tuple with initial location in city address coordinates
+            heading is the initial direction in degrees, only needed to start with a turn """
+        self._name = name if name is not None else color
+        self._emitted = 0 # path segments and station markers added by this line
         self._loc = start_address
-        self._angle = None # current heading
+        self._angle = heading # current heading
         self._dwg = drawing
         self._line = drawing.add(drawing.g(stroke=color, stroke_width=thick, fill='none', fill_opacity=0 ))
-        self._stations = drawing.add(drawing.g(stroke='black', stroke_width=STATION_THICK, fill='white', fill_opacity=100 ))
-        self._center = [MAX_W_ADDR*SCALE, MAX_S_ADDR*SCALE]
+        self._stations = StationRegistry.For(drawing, transform)
+        self._transform = transform
+        self._path = None # single <path> holding every segment of this line
+        self._track = track.Track()
+
+    def Branch(self):
+        """ Returns a new TrainLine that forks off at the current location and heading.
+            It shares this line's stroke group but draws into its own path. """
+        branch = copy.copy(self)
+        branch._path = None
+        branch._track = track.Track()
+        return branch
+
+    def Track(self):
+        """ Returns the arc length record of everything this line (not its branches) has drawn """
+        return self._track
+
+    def _segment(self, begin, command):
+        """ Appends a path command to this line's path, starting it at 'begin' if needed """
+        if self._path is None:
+            self._path = self._line.add(self._dwg.path(d="M %f,%f"%(begin[0], begin[1])))
+        self._path.push(command)
+        self._emitted += 1
 
     def AbsCoord(self, addr):
         """ Takes a Chicago street address (N/E: positive, S/W: negative) and maps it into absolute view coordiantes """
-        x = self._center[0] + addr[0] * SCALE
-        y = self._center[1] + addr[1] * -SCALE
-#        print("addr: {} -> coord: {}".format(addr, [x,y]))
-        return ([x,y])
+        return self._transform.Point(addr)
 
     def RelDistance(self, blocks):
         """ Takes a Chicago stree address range and maps it into a relative distance in the view coordiantes """
-        x = blocks[0] * SCALE
-        y = -blocks[1] * SCALE
-#        print("blocks: {} -> distance {}".format(blocks, [x,y]))
-        return ([x,y])
+        return self._transform.Distance(blocks)
 
     def Scale(self, value):
         """ Takes a value and scales it the same as address -> coordinates """
-        return (value*SCALE)
+        return self._transform.Length(value)
 
     def Address(self, coord):
         """ Takes absolute view coordinates and maps them to a Chicago street address """
-        x = (coord[0] - self._center[0]) / SCALE
-        y = (coord[1] - self._center[1]) / -SCALE
-        print("coord: {} -> address: {}".format(coord, [x,y]))
-        return ([x,y])
+        addr = self._transform.Address(coord)
+        log.debug("coord: %s -> address: %s", coord, addr)
+        return addr
 
     def Blocks(self, distance):
         """ Takes a relative view distance and maps it to a Chicago street address range """
-        x = distance[0] / SCALE
-        y = -distance[1] / SCALE
-#        print("distance: {} -> blocks: {}".format(distance, [x,y]))
-        return ([x,y])
+        return self._transform.Blocks(distance)
 
+    @_timed
     def DrawToAddress(self, address):
         """ Adds a line that moves from current location to address"""
         begin = self.AbsCoord(self._loc)
@@ -91,13 +309,15 @@ class TrainLine:
             'y0':begin[1],
             'x1':end[0],
             'y1':end[1]}
-        self._line.add(self._dwg.path(d="M %(x0)f,%(y0)f L %(x1)f,%(y1)f"%args))
+        self._segment(begin, "L %(x1)f,%(y1)f"%args)
+        self._track.AddLine(begin, end)
         self._angle = math.degrees(math.atan2(end[1]-begin[1],end[0]-begin[0]))
         #print("atan({},{}) angle: {}".format(end[1]-begin[1],end[0]-begin[0],self._angle))
         #print("DrawToAddress angle updated to: {}".format(self._angle))
         self._loc = address
-        print("M %(x0)f,%(y0)f L %(x1)f,%(y1)f"%args)
+        log.debug("M %(x0)f,%(y0)f L %(x1)f,%(y1)f", args)
 
+    @_timed
     def DrawBlocks(self, blocks):
         """ Adds a line that moves from current location to a relative distance in blocks"""
         dest = [self._loc[0] + blocks[0], self._loc[1] + blocks[1]]
@@ -110,8 +330,9 @@ class TrainLine:
         self._angle = math.degrees(math.atan2(end[1]-begin[1],end[0]-begin[0]))
         #print("atan({},{}) angle: {}".format(blocks[1], blocks[0],self._angle))
         #print("DrawBlocks angle updated to: {}".format(self._angle))
-        print("M %(x0)f,%(y0)f l %(x1)f,%(y1)f"%args)
-        self._line.add(self._dwg.path(d="M %(x0)f,%(y0)f L %(x1)f,%(y1)f"%args))
+        log.debug("M %(x0)f,%(y0)f l %(x1)f,%(y1)f", args)
+        self._segment(begin, "L %(x1)f,%(y1)f"%args)
+        self._track.AddLine(begin, end)
         self._loc = dest
 
     def polarToCartesian(self, point, radius, angleInDegrees):
@@ -119,6 +340,7 @@ class TrainLine:
         return ( [point[0] + (radius * math.cos(angleR)),
                   point[1] + (radius * math.sin(angleR))]);
 
+    @_timed
     def DrawTurn(self, degrees, radius=ARCH_R):
         """ Draws a turn of degrees from the current path.  
             negative degrees: counter-clockwise
@@ -144,8 +366,9 @@ class TrainLine:
             'endy': end[1],
             'lgarc': 0,
             'sweep': sweep}
-        print("M %(x0)f,%(y0)f A %(radius)f,%(radius)f %(ellipseRotation)f %(lgarc)d,%(sweep)d %(endx)f,%(endy)f"%args)
-        self._line.add(self._dwg.path(d="M %(x0)f,%(y0)f A %(radius)f,%(radius)f %(ellipseRotation)f %(lgarc)d,%(sweep)d %(endx)f,%(endy)f"%args))
+        log.debug("M %(x0)f,%(y0)f A %(radius)f,%(radius)f %(ellipseRotation)f %(lgarc)d,%(sweep)d %(endx)f,%(endy)f", args)
+        self._segment(begin, "A %(radius)f,%(radius)f %(ellipseRotation)f %(lgarc)d,%(sweep)d %(endx)f,%(endy)f"%args)
+        self._track.AddArc(center, vector_radius, center_angle + 180, degrees)
         self._loc = self.Address(end)
         self._angle = self._angle + degrees
 #        print("DrawTurn angle updated to: {}".format(self._angle))
@@ -155,11 +378,12 @@ class TrainLine:
 #        self._stations.add(self._dwg.circle(center, r=2))
 #        self._stations.add(self._dwg.circle(end, r=3))
 
-    def DrawStationIntersection(self, intersect):
+    def DrawStationIntersection(self, intersect, name=None):
         """ Draw a station behind the current location (180 from current angle) where
             it intersects the line 'intersect'.  'intersect' must be either:
               [x, None] - N/S line
               [None, y] - E/W line
+            Lines drawing a station with the same 'name' share its marker.
         """
         if (intersect[0] is not None):
             delta_x = self._loc[0] - intersect[0]
@@ -169,234 +393,215 @@ class TrainLine:
             delta_y = self._loc[1] - intersect[1]
             station_x = self._loc[0] + delta_y / math.tan(math.radians(self._angle))
             station_y = intersect[1]
-        self.DrawStationAbs([station_x, station_y])
+        self.DrawStationAbs([station_x, station_y], name)
 
     def DrawStation(self, blocks):
         """ Draw a station blocks away from current location """
         self.DrawStationAbs([self._loc[0]+blocks[0], self._loc[1]+blocks[1]])
 
-    def DrawStationAbs(self, address):
+    @_timed
+    def DrawStationAbs(self, address, name=None):
         """ Draw a station at absolute location 'address'  """
         coords = self.AbsCoord(address)
         vector_radius = self.Scale(STATION_RADIUS)
-        print("M {} CIRCLE({})".format(coords, vector_radius))
-        self._stations.add(self._dwg.circle(coords, r=vector_radius))
-
-
-class GreenLine:
-    """ Class for drawing Green line """
-    def __init__(self, drawing, color=GREENCOLOR):
-        _line = TrainLine(drawing, [-7200,400], color=color)
-        # Harlem to Cicero
-        loc = addLine(dwg, greenline, p0=addrToCoord([-7200,400]), p1=(addrToCoord([-4800,400])))
-        # Cicero to California
-        loc = addRelLine(dwg, greenline, loc, distance=blocksToRel([4800-2800,-100]))
-        # California to Ashland
-        loc = addRelLine(dwg, greenline, loc, distance=blocksToRel([2800-1600,50]))
-        # Ashland to Loop (loop is exagerated)
-        loc = addRelLine(dwg, greenline, loc, distance=blocksToRel([1600,00]))
-        # Loop Curve
-        loc = addRelArc(dwg, greenline, p0=loc, distance=[radius,radius], radius=radius, direction=[0,1])
-        # Loop to Indiana
-        loc = addRelLine(dwg, greenline, loc, distance=blocksToRel([0,-3900]))
-        # Indiana dogleg
-        loc = addRelArc(dwg, greenline, p0=loc, distance=[radius,radius], radius=radius, direction=[0,0])
-        loc = addRelArc(dwg, greenline, p0=loc, distance=[radius,radius], radius=radius, direction=[0,1])
-        # dogleg to split
-        loc = addRelLine(dwg, greenline, loc, distance=blocksToRel([0,3900-5900]))
-        # Split to 63rd (Cottage Gove leg)
-        split = loc
-        loc = addRelLine(dwg, greenline, loc, distance=blocksToRel([0,5900-6300]))
-        loc63rd = loc
-        loc = addRelArc(dwg, greenline, p0=loc, distance=[radius,radius], radius=radius, direction=[0,0])
-        # 63rd to Cottage Grove
-        loc = addRelLine(dwg, greenline, loc, distance=blocksToRel([800,0]))
-        # Split to wells (Ashland/63rd Leg)
-        loc = addRelArc(dwg, greenline, p0=split, distance=[-radius,radius], radius=radius, direction=[0,1])
-        loc = addRelLine(dwg, greenline, loc, distance=blocksToRel([-800,0]))
-        loc = addRelArc(dwg, greenline, p0=loc, distance=[-radius,radius], radius=radius, direction=[0,0])
-        loc = addLine(dwg, greenline, loc, distance=blocksToRel([0,loc63rd[1]]))
-        loc = addRelArc(dwg, greenline, p0=loc, distance=[-radius,radius], radius=radius, direction=[0,1])
-
-class PinkLine:
-    """ Class for drawing Pink line """
-    def __init__(self, drawing, begin, color=PINKCOLOR):
-        print("#### Loop Pink Line ####")
-        _line = TrainLine(drawing, begin, color)
-        _line.DrawBlocks([-2000,0])
-        _line.DrawTurn(-90)
-        _line.DrawBlocks([0,-2400])
-        _line.DrawTurn(90)
-        _line.DrawBlocks([-3700,0])
+        log.debug("M %s CIRCLE(%s)", coords, vector_radius)
+        count = len(self._stations.Stations())
+        station = self._stations.Add(address, coords, name)
+        self._emitted += len(self._stations.Stations()) - count
+        return station
+
+
+GEOMETRY_VERSION = 3 # bump when the compiled format changes
+
+def _GeometryKey(data):
+    """ Cache key for compiled geometry: the line data plus every constant the compiler uses """
+    consts = repr((GEOMETRY_VERSION, WIDTH, HEIGHT, MAX_W_ADDR, MAX_E_ADDR, MAX_N_ADDR, MAX_S_ADDR,
+                   ARCH_R, STATION_RADIUS, STATION_SNAP, LINE_THICK))
+    return hashlib.sha1(data + consts.encode()).hexdigest()
+
+def _RunSteps(line, steps, spec, entry, lines):
+    """ Executes the drawing steps of a line spec on a TrainLine """
+    lines.append(line)
+    for step in steps:
+        op, args = step[0], step[1:]
+        if op == 'blocks':
+            line.DrawBlocks(args[0])
+        elif op == 'to':
+            line.DrawToAddress(entry[args[0]] if isinstance(args[0], str) else args[0])
+        elif op == 'turn':
+            line.DrawTurn(*args)
+        elif op == 'station':
+            line.DrawStation(args[0])
+        elif op == 'station_abs':
+            line.DrawStationAbs(args[0])
+        elif op == 'station_at':
+            line.DrawStationIntersection(spec['el_stations'][args[0]]['at'], args[0])
+        elif op == 'entry':
+            entry[args[0]] = list(line._loc)
+        elif op == 'branch':
+            _RunSteps(line.Branch(), args[0], spec, entry, lines)
+        else:
+            raise ValueError("Unknown step '{}' in line {}".format(op, line._name))
+
+def CompileGeometry(spec):
+    """ Turns a line spec (see lines.json) into path data and station coordinates:
+        { 'entry': {name: address}, 'el_stations': {name: {'at', 'gtfs'}} as in the spec,
+          'lines': [ {'name', 'color', 'thick', 'enabled',
+                      'paths': [path data per branch],
+                      'tracks': [Track.ToList() per branch],
+                      'stations': [[snapped address, view coords, track index, distance, name], ...]} ] }
+        Each station is located on the nearest branch track by its distance along it (both
+        None for a line that draws no track).  name
+        is the el_stations name of a shared station (see StationRegistry), otherwise None. """
+    global _compiling
+    _compiling, compiling = True, _compiling
+    try:
+        return _Compile(spec)
+    finally:
+        _compiling = compiling
+
+def _Compile(spec):
+    entry = {k: list(v) for k, v in spec['entry'].items()}
+    compiled = {'entry': entry, 'el_stations': spec['el_stations'], 'lines': []}
+    for line_spec in spec['lines']:
+        # Each line is traced on its own throwaway drawing so its stations can be read back
+        scratch = svgfast.Drawing()
+        start = line_spec['start']
+        line = TrainLine(scratch, entry[start] if isinstance(start, str) else start,
+                         color=line_spec['color'], thick=line_spec.get('thick', LINE_THICK),
+                         name=line_spec['name'], heading=line_spec.get('heading'))
+        log.debug("#### %s ####", line_spec['name'])
+        lines = []
+        _RunSteps(line, line_spec['steps'], spec, entry, lines)
+        stations = StationRegistry.For(scratch).Located()
+        drawn = [l for l in lines if l._path is not None]
+        located = []
+        for key, (address, coords) in stations.items():
+            index = distance = None
+            if drawn:
+                projections = [l.Track().Project(coords) for l in drawn]
+                index = min(range(len(drawn)), key=lambda i: projections[i][1])
+                distance = projections[index][0]
+            located.append([address, coords, index, distance, key if isinstance(key, str) else None])
+        compiled['lines'].append({
+            'name': line_spec['name'],
+            'color': line_spec['color'],
+            'thick': line_spec.get('thick', LINE_THICK),
+            'enabled': line_spec.get('enabled', True),
+            'paths': [' '.join(l._path.commands) for l in drawn],
+            'tracks': [l.Track().ToList() for l in drawn],
+            'stations': located,
+        })
+    return compiled
+
+_geometry = {}
+
+def LoadGeometry(path=LINES_FILE, cache=True):
+    """ Returns the compiled geometry for a line data file.  Results are kept in memory
+        and, with cache=True, in '<path>.compiled' next to the data file, keyed by the
+        contents of the data file and the drawing constants. """
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    key = _GeometryKey(data)
+    if key in _geometry:
+        return _geometry[key]
+
+    cache_file = path + '.compiled'
+    compiled = None
+    if cache and os.path.exists(cache_file):
+        try:
+            with open(cache_file) as fh:
+                cached = json.load(fh)
+            if cached.get('key') == key:
+                compiled = cached['geometry']
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring compiled geometry cache: %s", e)
+    if compiled is None:
+        compiled = CompileGeometry(json.loads(data))
+        if cache:
+            tmp = cache_file + '.tmp'
+            try:
+                with open(tmp, 'w') as fh:
+                    json.dump({'key': key, 'geometry': compiled}, fh)
+                os.replace(tmp, cache_file)
+            except OSError as e:
+                # e.g. a read-only install, the in-memory result still works
+                log.warning("Not caching compiled geometry: %s", e)
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+    _geometry[key] = compiled
+    return compiled
+
+def LineTracks(line):
+    """ Returns the track.Track of each branch of a compiled line """
+    return [track.Track.FromList(pieces) for pieces in line['tracks']]
+
+def DrawLine(drawing, line):
+    """ Adds one compiled line (paths and stations) to a drawing """
+    start = time.perf_counter()
+    group = drawing.add(drawing.g(stroke=line['color'], stroke_width=line['thick'], fill='none', fill_opacity=0 ))
+    for d in line['paths']:
+        group.add(drawing.path(d=d))
+    stations = StationRegistry.For(drawing)
+    count = len(stations.Stations())
+    for station in line['stations']:
+        stations.Add(station[0], station[1], station[4])
+    stations.Raise()
+    added = len(stations.Stations()) - count
+    log.debug("%s: %d paths, %d stations (%d new)", line['name'], len(line['paths']),
+              len(line['stations']), added)
+    if _stats is not None:
+        _stats.Add(line['name'], 'DrawLine', len(line['paths']) + added, time.perf_counter() - start)
+    return group
+
+def StationId(station):
+    """ Element id of a compiled station """
+    return StationRegistry.Id(station[4] if station[4] is not None else station[0])
+
+def DrawLines(drawing, names=None, geometry=None):
+    """ Draws compiled lines in data file order.  names=None draws every enabled line. """
+    geometry = geometry if geometry is not None else LoadGeometry()
+    for line in geometry['lines']:
+        if (names is None and line['enabled']) or (names is not None and line['name'] in names):
+            DrawLine(drawing, line)
 
 class Loop:
-    """ Class for drawing the Loop lines """
+    """ Class for drawing the lines, the Loop and the branches out of it.  The draw<Route>
+        flags leave out routes, everything else enabled in lines.json is drawn """
     def __init__(self, drawing, drawGreen=True, drawBlue=True, drawBrown=True,
                  drawRed=True, drawOrange=True, drawPink=True, drawPurple=True,
-                 drawStations=True, drawStationMarkers=False):
+                 drawStations=True, drawStationMarkers=False, geometry=None):
+        geometry = geometry if geometry is not None else LoadGeometry()
         # Entry points in the loop for each line
-        self._entry =  {
-            'blue_west': [-200, -200],
-            'blue_south': None,
-            'red_south': [2000, -3600],
-            'red_north': None,
-            'pink': [-200, 200],
-            'green_west': [-200, 400],
-            'green_south': None,
-            'orange': [2500, -3600],
-            'purple': [400, 1400],
-            'brown': [600, 1400],
-        }
-        self._xrange = [min([x[0] for x in self._entry.values() if x is not None]),
-                        max([x[0] for x in self._entry.values() if x is not None])]
-        self._yrange = [min([y[1] for y in self._entry.values() if y is not None]),
-                        max([y[1] for y in self._entry.values() if y is not None])]
-        
+        self._entry = geometry['entry']
+        self._xrange = [min([x[0] for x in self._entry.values()]),
+                        max([x[0] for x in self._entry.values()])]
+        self._yrange = [min([y[1] for y in self._entry.values()]),
+                        max([y[1] for y in self._entry.values()])]
+
         # Cross point for each loop station
-        self._el_stations = {
-            'clark': [1200, None],
-            'state': [1900, None],
-            'washington': [None, -750],
-            'adams': [None, -1750],
-            'hwl': [1900,None],
-            'lasalle': [1200, None],
-            'quincy': [None, -1750],
-            'monroe': [None, -1200],
-            'jackson': [None, -2100],
-        }
-
-        if drawBlue:
-            print("#### Blue Line ####")
-            blueline = TrainLine(drawing, self._entry['blue_west'], color=BLUECOLOR)
-            blueline.DrawBlocks([1600,0])
-            blueline.DrawStationIntersection(self._el_stations['clark'])
-            blueline.DrawTurn(90)
-            blueline.DrawBlocks([0,-3200])
-            blueline.DrawStationIntersection(self._el_stations['monroe'])
-            blueline.DrawStationIntersection(self._el_stations['jackson'])
-
-        if drawRed:
-            print("#### Red Line ####")
-            redline = TrainLine(drawing, self._entry['red_south'], color=REDCOLOR)
-            redline.DrawBlocks([0,5000])
-            self._entry['red_north'] = redline.Address(redline._loc)
-            redline.DrawStation([0,-1800])
-            #redline.DrawStation([0,-2600])
-            #redline.DrawStation([0,-3500])
-            redline.DrawStationIntersection(self._el_stations['monroe'])
-            redline.DrawStationIntersection(self._el_stations['jackson'])
-                    
-        if drawOrange:
-            # Start at SE corner and go W, N, E, S
-            print("#### Loop Orange Line ####")
-            orangeline = TrainLine(drawing, self._entry['orange'], color=ORANGECOLOR)
-            orangeline.DrawBlocks([0,800])
-            orangeline.DrawTurn(-61)
-            orangeline.DrawTurn(61)
-            orangeline.DrawBlocks([0,2248])
-            orangeline.DrawStationIntersection(self._el_stations['adams'])
-            orangeline.DrawStationIntersection(self._el_stations['washington'])
-            orangeline.DrawTurn(-90)
-            orangeline.DrawBlocks([-1095,0])
-            orangeline.DrawStationIntersection(self._el_stations['state'])
-            orangeline.DrawStationIntersection(self._el_stations['clark'])
-            orangeline.DrawTurn(-90)
-            orangeline.DrawBlocks([0,-2090])
-            orangeline.DrawStationIntersection(self._el_stations['washington'])
-            orangeline.DrawStationIntersection(self._el_stations['quincy'])
-            orangeline.DrawTurn(-90)
-            orangeline.DrawBlocks([1300,0])
-            orangeline.DrawStationIntersection(self._el_stations['lasalle'])
-            orangeline.DrawStationIntersection(self._el_stations['hwl'])
-
-        if drawGreen:
-            # Start at NW corner go E, S
-            print("#### Loop Green Line ####")
-            greenline = TrainLine(drawing, self._entry['green_west'], color=GREENCOLOR)
-            greenline.DrawBlocks([2700,0])
-            greenline.DrawStationIntersection(self._el_stations['state'])
-            greenline.DrawStationIntersection(self._el_stations['clark'])
-            greenline.DrawTurn(90)
-            greenline.DrawBlocks([0,-3800])
-            self._entry['green_south'] = greenline.Address(greenline._loc)
-            greenline.DrawStationIntersection(self._el_stations['washington'])
-            greenline.DrawStationIntersection(self._el_stations['adams'])
-
-        if drawPink:
-            # Start at NW corner go E, S, W, N
-            print("#### Loop Pink Line ####")
-            pinkline = TrainLine(drawing, self._entry['pink'], color=PINKCOLOR)
-            pinkline.DrawBlocks([2500,0])
-            pinkline.DrawStationIntersection(self._el_stations['clark'])
-            pinkline.DrawStationIntersection(self._el_stations['state'])
-            pinkline.DrawTurn(90)
-            pinkline.DrawBlocks([0,-2500])
-            pinkline.DrawStationIntersection(self._el_stations['washington'])
-            pinkline.DrawStationIntersection(self._el_stations['adams'])
-            pinkline.DrawTurn(90)
-            pinkline.DrawBlocks([-1500,0])
-            pinkline.DrawStationIntersection(self._el_stations['hwl'])
-            pinkline.DrawStationIntersection(self._el_stations['lasalle'])
-            pinkline.DrawTurn(90)
-            pinkline.DrawBlocks([0,2500])
-            pinkline.DrawStationIntersection(self._el_stations['quincy'])
-            pinkline.DrawStationIntersection(self._el_stations['washington'])
-            pinkline.DrawTurn(-90)
-
-        if drawBrown:
-            # Start at NW corner go E, S, W, N (then jog back to origin)
-            print("#### Loop Brown Line ####")
-            brownline = TrainLine(drawing, self._entry['brown'], color=BROWNCOLOR)
-            brownline.DrawBlocks([0,-400])
-            brownline.DrawTurn(-90)
-            brownline.DrawBlocks([2100,0])
-            brownline.DrawStationIntersection(self._el_stations['clark'])
-            brownline.DrawStationIntersection(self._el_stations['state'])
-            brownline.DrawTurn(90)
-            brownline.DrawBlocks([0,-3500])
-            brownline.DrawStationIntersection(self._el_stations['washington'])
-            brownline.DrawStationIntersection(self._el_stations['adams'])
-            brownline.DrawTurn(90)
-            brownline.DrawBlocks([-2500,0])
-            brownline.DrawStationIntersection(self._el_stations['hwl'])
-            brownline.DrawStationIntersection(self._el_stations['lasalle'])
-            brownline.DrawTurn(90)
-            brownline.DrawBlocks([0,3800])
-            brownline.DrawStationIntersection(self._el_stations['quincy'])
-            brownline.DrawStationIntersection(self._el_stations['washington'])
-            brownline.DrawTurn(90)
-            brownline.DrawTurn(-90)
-
-        if drawPurple:
-            # Start at NW corner go S, E, N, W
-            print("#### Loop Purple Line ####")
-            purpleline = TrainLine(drawing, self._entry['purple'], color=PURPLECOLOR)
-            purpleline.DrawBlocks([0,-600])
-            purpleline.DrawTurn(-90)
-            purpleline.DrawBlocks([2100,0])
-            purpleline.DrawStationIntersection(self._el_stations['clark'])
-            purpleline.DrawStationIntersection(self._el_stations['state'])
-            purpleline.DrawTurn(90)
-            purpleline.DrawBlocks([0,-3100])
-            purpleline.DrawStationIntersection(self._el_stations['washington'])
-            purpleline.DrawStationIntersection(self._el_stations['adams'])
-            purpleline.DrawTurn(90)
-            purpleline.DrawBlocks([-2100,0])
-            purpleline.DrawStationIntersection(self._el_stations['hwl'])
-            purpleline.DrawStationIntersection(self._el_stations['lasalle'])
-            purpleline.DrawTurn(90)
-            purpleline.DrawBlocks([0,3500])
-            purpleline.DrawStationIntersection(self._el_stations['quincy'])
-            purpleline.DrawStationIntersection(self._el_stations['washington'])
+        self._el_stations = {name: s['at'] for name, s in geometry['el_stations'].items()}
+
+        # Every enabled line is drawn unless its route (the name up to any '_',
+        # e.g. pink for pink_west) is turned off
+        flags = {'blue': drawBlue, 'red': drawRed, 'orange': drawOrange, 'green': drawGreen,
+                 'pink': drawPink, 'brown': drawBrown, 'purple': drawPurple}
+        names = [line['name'] for line in geometry['lines']
+                 if line['enabled'] and flags.get(line['name'].split('_')[0], True)]
+        if not drawStations:
+            geometry = dict(geometry, lines=[dict(line, stations=[]) for line in geometry['lines']])
+        DrawLines(drawing, names, geometry)
 
         if drawStationMarkers:
             # Draws a line where the stations go
             for station,loc in self._el_stations.items():
                 if loc[0] is not None:
-                    marker = TrainLine(drawing, [loc[0],self._yrange[0]], 'black', thick=1)
+                    marker = TrainLine(drawing, [loc[0],self._yrange[0]], 'black', thick=1, name='marker')
                     marker.DrawToAddress([loc[0],self._yrange[1]])
                 elif loc[1] is not None:
-                    marker = TrainLine(drawing, [self._xrange[0], loc[1]], 'black', thick=1)
+                    marker = TrainLine(drawing, [self._xrange[0], loc[1]], 'black', thick=1, name='marker')
                     marker.DrawToAddress([self._xrange[1], loc[1]])
 
     def GetPink(self):
@@ -411,25 +616,64 @@ class Loop:
     def GetOrange(self):
         return self._entry['orange'];
 
-dwg = svgwrite.Drawing(filename='graphic.svg', profile='tiny')
-dwg.viewbox(0,0,WIDTH,HEIGHT)
-
-loop = Loop(dwg)
-pink = PinkLine(dwg, loop.GetPink())
-#loop = Loop(dwg, drawGreen=True, drawBlue=False, drawBrown=False, drawRed=False, drawOrange=False,
-#            drawPink=False, drawPurple=False,  drawStationMarkers=True)
-
-#print("Draw maker")
-#marker = [-1200, None]
-#markline = TrainLine(dwg, [marker[0], -200], color='black', thick=1)
-#markline.DrawToAddress([marker[0],2400])
-#marker = [None, 1000]
-#markline = TrainLine(dwg, [-2600, marker[1]], color='black', thick=1)
-#markline.DrawToAddress([-200, marker[1]])
-#
-#print("\nDraw green")
-#greenline = TrainLine(dwg, [-2400, 0], color=GREENCOLOR)
-#greenline.DrawBlocks([2000,4000])
-#greenline.DrawStationIntersection(marker)
-
-dwg.save()
+def DrawMap(drawing, geometry=None):
+    """ Draws the standard map: every enabled line in lines.json """
+    return Loop(drawing, geometry=geometry)
+
+def NewDrawing(filename, backend='svgwrite', debug=None, size=None):
+    """ Returns an empty map drawing from an output backend:
+          'svgwrite' - svgwrite.Drawing, validates every element (default)
+          'fast'     - svgfast.Drawing, formats straight into the output file
+        debug turns validation on/off; None keeps the backend's default.
+        size is the (width, height) of the image, the view box is always WIDTH x HEIGHT. """
+    extra = {} if debug is None else {'debug': debug}
+    if size is not None:
+        extra['size'] = size
+    if backend == 'fast':
+        dwg = svgfast.Drawing(filename=filename, profile='tiny', **extra)
+    else:
+        dwg = svgwrite.Drawing(filename=filename, profile='tiny', **extra)
+    dwg.viewbox(0,0,WIDTH,HEIGHT)
+    return dwg
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Draw the CTA map')
+    parser.add_argument('-o', '--output', default='graphic.svg', help='SVG file (default: %(default)s)')
+    parser.add_argument('--backend', choices=['svgwrite', 'fast'], default='svgwrite',
+                        help='SVG output backend (default: %(default)s)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='log every drawing call (recompiles the line geometry)')
+    parser.add_argument('--stats', action='store_true',
+                        help='report elements and time per line and drawing call on stderr, '
+                             'for compiling the line geometry and drawing it')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format='%(message)s')
+    if args.stats:
+        stats = EnableStats()
+
+    dwg = NewDrawing(args.output, backend=args.backend)
+
+    # The compiled geometry cache would hide the TrainLine calls being traced
+    geometry = LoadGeometry(cache=not (args.stats or args.verbose))
+    loop = DrawMap(dwg, geometry=geometry)
+    #loop = Loop(dwg, drawGreen=True, drawBlue=False, drawBrown=False, drawRed=False, drawOrange=False,
+    #            drawPink=False, drawPurple=False,  drawStationMarkers=True)
+
+    #print("Draw maker")
+    #marker = [-1200, None]
+    #markline = TrainLine(dwg, [marker[0], -200], color='black', thick=1, name='marker')
+    #markline.DrawToAddress([marker[0],2400])
+    #marker = [None, 1000]
+    #markline = TrainLine(dwg, [-2600, marker[1]], color='black', thick=1, name='marker')
+    #markline.DrawToAddress([-200, marker[1]])
+    #
+    #print("\nDraw green")
+    #greenline = TrainLine(dwg, [-2400, 0], color=GREENCOLOR)
+    #greenline.DrawBlocks([2000,4000])
+    #greenline.DrawStationIntersection(marker)
+
+    dwg.save()
+    if args.stats:
+        print(stats.Format(), file=sys.stderr)
@@ -1,9 +1,5 @@
+import argparse
 import json
-import gtfs_kit as gk
-
-#url="https://www.transitchicago.com/downloads/sch_data/google_transit.zip"
-#feed = gk.read_feed(url, dist_units="mi")
-feed = gk.read_feed('google_transit.zip', dist_units='mi')
 
 # Generate a list of dicts representing the station data from GTFS.  Each
 # Route dictionary contains a list of stations:
@@ -16,20 +12,93 @@ feed = gk.read_feed('google_transit.zip', dist_units='mi')
 #   ]
 # }
 
-stationdata = []
-
-# Only train routes (route_type == 1)
-for route in feed.routes[feed.routes.route_type == 1].to_dict('records'):
-  route['stations'] = []
+def route_stations(routes, trips, stop_times, stops):
+  """ Returns a DataFrame of unique (route_id, station_id) pairs for all train
+      routes (route_type == 1).  Built as one join across the whole feed:
+      routes -> trips -> stop_times -> stops -> parent station """
+  rail = routes.loc[routes.route_type == 1, ['route_id']]
+  rail_trips = trips[['trip_id', 'route_id']].merge(rail, on='route_id')
+  served = (stop_times[['trip_id', 'stop_id']]
+            .merge(rail_trips, on='trip_id')[['route_id', 'stop_id']]
+            .drop_duplicates())
 
   # There are multiple stops at a station, so distill down to stations
-  stations = set()
-  for stop in feed.get_stops(route_ids=[route['route_id']]).to_dict('records'):
-    stations.add(stop['parent_station'])
-  for sid in stations:
-    sd=feed.stops[feed.stops.stop_id == sid].to_dict('records')[0]
-    route['stations'].append(sd)
+  parent = stops.set_index('stop_id').parent_station
+  served['station_id'] = parent.reindex(served.stop_id).to_numpy()
+  return served[['route_id', 'station_id']].dropna().drop_duplicates()
+
+def extract_stations(routes, trips, stop_times, stops):
+  """ Builds the station export described above from GTFS tables """
+  pairs = route_stations(routes, trips, stop_times, stops)
+
+  # Each station row is looked up once by index instead of rescanning stops
+  stops_by_id = stops.set_index('stop_id', drop=False)
+  station_ids = pairs.station_id.unique()
+  station_rows = stops_by_id.loc[station_ids].to_dict('index')
+  by_route = {rid: sorted(sids) for rid, sids in pairs.groupby('route_id').station_id}
+
+  stationdata = []
+  for route in routes[routes.route_type == 1].to_dict('records'):
+    sids = by_route.get(route['route_id'], [])
+    route['stations'] = [dict(station_rows[sid]) for sid in sids]
+    stationdata.append(route)
+  return stationdata
+
+def read_tables(path, lean=False):
+  """ Returns the (routes, trips, stop_times, stops) tables from a GTFS zip """
+  if lean:
+    import gtfs_stream
+    return gtfs_stream.read_rail_tables(path)
+  import gtfs_kit as gk
+  #url="https://www.transitchicago.com/downloads/sch_data/google_transit.zip"
+  #feed = gk.read_feed(url, dist_units="mi")
+  feed = gk.read_feed(path, dist_units='mi')
+  return feed.routes, feed.trips, feed.stop_times, feed.stops
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Export CTA train stations from GTFS')
+  parser.add_argument('feed', nargs='?', default='google_transit.zip',
+                      help='GTFS zip file (default: %(default)s)')
+  parser.add_argument('--lean', action='store_true',
+                      help='stream only the needed tables/columns instead of gtfs_kit')
+  parser.add_argument('--cache-dir', default='.feed_cache',
+                      help='cache of parsed feeds and exports (default: %(default)s)')
+  parser.add_argument('--no-cache', action='store_true',
+                      help='always re-read the feed')
+  parser.add_argument('--previous',
+                      help='previous export; only rebuild routes whose stations changed')
+  parser.add_argument('--diff',
+                      help='with --previous, write the station diff to this file')
+  parser.add_argument('--compact',
+                      help='also write the compact station model (station_model.py) to this file')
+  args = parser.parse_args()
 
-  stationdata.append(route)
+  if args.no_cache:
+    tables = lambda: read_tables(args.feed, lean=args.lean)
+    export = lambda build: build()
+  else:
+    import feed_cache
+    import gtfs_stream
+    cache = feed_cache.FeedCache(args.cache_dir)
+    # gtfs_kit and the lean loader type columns differently, keep them apart
+    key = feed_cache.feed_key(args.feed, 'lean' if args.lean else 'gtfs_kit')
+    def load():
+      tables = read_tables(args.feed, lean=args.lean)
+      return tables if args.lean else gtfs_stream.rail_subset(*tables)
+    tables = lambda: cache.tables(key, load)
+    export = lambda build: cache.stations(key, build)
 
-print(json.dumps(stationdata))
+  if args.previous:
+    import station_diff
+    with open(args.previous) as fh:
+      previous = json.load(fh)
+    stationdata, diff = station_diff.incremental_export(previous, *tables())
+    if args.diff:
+      with open(args.diff, 'w') as fh:
+        json.dump(diff, fh)
+  else:
+    stationdata = export(lambda: extract_stations(*tables()))
+  if args.compact:
+    import station_model
+    station_model.StationModel.from_export(stationdata).save(args.compact)
+  print(json.dumps(stationdata))
@@ -0,0 +1,101 @@
+import zipfile
+import pandas as pd
+
+# Lean alternative to gk.read_feed() for the station export.  Only the tables
+# get_station_data.py needs are read, straight out of the zip, and
+# stop_times.txt is streamed in chunks so the whole table is never held in
+# memory at once.
+
+CHUNKSIZE = 500000
+
+# GTFS text fields (the 'string' columns of gtfs_kit for these tables).  Read
+# as strings so ids that look numeric stay strings, and so a text column that
+# is empty throughout comes back as None rather than a float NaN column.
+STR_COLUMNS = ['route_id', 'agency_id', 'route_short_name', 'route_long_name',
+               'route_desc', 'route_url', 'route_color', 'route_text_color',
+               'trip_id', 'service_id', 'trip_headsign', 'trip_short_name',
+               'block_id', 'shape_id',
+               'stop_id', 'stop_code', 'stop_name', 'stop_desc', 'zone_id',
+               'stop_url', 'parent_station', 'stop_timezone', 'level_id',
+               'platform_code']
+
+# GTFS integer fields, read as nullable integers so optional columns with
+# blanks (e.g. location_type on platforms) stay 1 / None like gtfs_kit's
+# instead of turning into 1.0 / NaN floats
+INT_COLUMNS = ['route_type', 'route_sort_order', 'continuous_pickup',
+               'continuous_drop_off', 'direction_id', 'wheelchair_accessible',
+               'bikes_allowed', 'location_type', 'wheelchair_boarding']
+
+def _read_member(archive, name, usecols=None, chunksize=None):
+  """ Reads a GTFS member from an open zip, optionally only some columns """
+  fh = archive.open(name)
+  dtype = {c: str for c in STR_COLUMNS if usecols is None or c in usecols}
+  dtype.update({c: 'Int64' for c in INT_COLUMNS if usecols is None or c in usecols})
+  df = pd.read_csv(fh, encoding='utf-8-sig', dtype=dtype, usecols=usecols,
+                   chunksize=chunksize)
+  if chunksize is None:
+    # Missing strings are None like gtfs_kit (and JSON null), not NaN.
+    # Missing integers are pd.NA, which to_dict() also turns into None.
+    for col in df.select_dtypes(exclude='number').columns:
+      df[col] = df[col].astype(object).where(df[col].notna(), None)
+  return df
+
+def read_rail_tables(path, route_type=1, chunksize=CHUNKSIZE):
+  """ Returns (routes, trips, stop_times, stops) restricted to routes of
+      'route_type'.  routes and stops keep all columns since they end up in
+      the export.  trips only has trip_id/route_id for matching routes.
+
+      stop_times is reduced while reading to one representative trip for
+      every (route, stop) pair, which is all the station export needs, so
+      peak memory is bounded by the number of rail stops and not the size
+      of stop_times.txt.  stops is reduced to the served platforms and
+      their stations. """
+  with zipfile.ZipFile(path) as archive:
+    routes = _read_member(archive, 'routes.txt')
+    routes = routes[routes.route_type == route_type].reset_index(drop=True)
+
+    trips = _read_member(archive, 'trips.txt', usecols=['trip_id', 'route_id'])
+    trips = trips[trips.route_id.isin(routes.route_id)].reset_index(drop=True)
+    trip_route = trips.set_index('trip_id').route_id
+
+    chunks = _read_member(archive, 'stop_times.txt',
+                          usecols=['trip_id', 'stop_id'], chunksize=chunksize)
+    stop_times = _reduce_stop_times(chunks, trip_route)
+
+    stops = _served_stops(_read_member(archive, 'stops.txt'), stop_times)
+
+  return routes, trips, stop_times, stops
+
+def rail_subset(routes, trips, stop_times, stops, route_type=1):
+  """ Applies the same reduction as read_rail_tables() to tables that
+      were already fully loaded (e.g. by gtfs_kit) """
+  routes = routes[routes.route_type == route_type].reset_index(drop=True)
+  trips = trips.loc[trips.route_id.isin(routes.route_id), ['trip_id', 'route_id']]
+  trips = trips.reset_index(drop=True)
+  trip_route = trips.set_index('trip_id').route_id
+  stop_times = _reduce_stop_times([stop_times[['trip_id', 'stop_id']]], trip_route)
+  return routes, trips, stop_times, _served_stops(stops, stop_times)
+
+def _served_stops(stops, stop_times):
+  """ Keeps only the stops in stop_times and their parent stations """
+  served = stops.stop_id.isin(stop_times.stop_id)
+  parents = stops.parent_station[served].dropna()
+  keep = served | stops.stop_id.isin(parents)
+  return stops[keep].reset_index(drop=True)
+
+def _reduce_stop_times(chunks, trip_route):
+  """ Keeps one (trip_id, stop_id) row per (route, stop) pair out of an
+      iterable of stop_times chunks """
+  pieces = []
+  for chunk in chunks:
+    chunk = chunk[chunk.trip_id.isin(trip_route.index)]
+    if chunk.empty:
+      continue
+    chunk = chunk.assign(route_id=trip_route.reindex(chunk.trip_id).to_numpy())
+    pieces.append(chunk.drop_duplicates(['route_id', 'stop_id']))
+  if not pieces:
+    return pd.DataFrame({'trip_id': pd.Series(dtype=str),
+                         'stop_id': pd.Series(dtype=str)})
+  stop_times = pd.concat(pieces, ignore_index=True)
+  stop_times = stop_times.drop_duplicates(['route_id', 'stop_id'])
+  return stop_times[['trip_id', 'stop_id']].reset_index(drop=True)
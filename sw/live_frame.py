@@ -0,0 +1,234 @@
+import argparse
+import asyncio
+import json
+import sys
+import numpy as np
+import gen_graphics
+import projection
+
+# Live map as a static base layer plus a stream of small patches.  The track
+# geometry never changes between frames, so it is rendered once (RenderBase)
+# with an empty <g id="trains"> on top.  Each frame only the dynamic state is
+# rebuilt: one element per train and a state per station marker.  Update()
+# compares it with the previous frame and returns just the differences:
+#
+#   {"op": "add",    "id": "train_801", "attrs": {"x": 512.3, "y": 880.1, "route": "red"}}
+#   {"op": "set",    "id": "train_801", "attrs": {"y": 884.0}}
+#   {"op": "remove", "id": "train_802"}
+#   {"op": "set",    "id": "station_1200_400", "attrs": {"class": "approaching"}}
+#
+# so the cost of a frame follows the number of trains that moved, not the size
+# of the map.
+
+PRECISION = 1      # decimals kept in view coordinates, hides sub-pixel jitter
+# Trains within this many view units of their route's track are drawn on it.  Only a
+# train's own route is searched, so this can be generous: the Loop is drawn
+# schematically, with lanes up to ~3000 addresses from the real tracks.
+SNAP_TRACK = 300.0
+# Trains projecting onto the end of a drawn track from further out than this are past
+# the drawn section and stay where they are, rather than piling up on its end
+SNAP_END = 10.0
+SNAP_STATION = 300 # GTFS stations within this many addresses of an unnamed map station use its marker
+
+# Route of each Train Tracker route code.  The lines.json lines of a route are
+# those named '<route>' or '<route>_<part>' (e.g. green_west)
+ROUTE_PREFIX = {
+    'red': 'red',
+    'blue': 'blue',
+    'brn': 'brown',
+    'g': 'green',
+    'org': 'orange',
+    'p': 'purple',
+    'pink': 'pink',
+    'y': 'yellow',
+}
+
+class TrainPlacer:
+    """ Maps train lat/lon onto the map, pulled onto the nearest drawn track of the
+        train's own route """
+    def __init__(self, geometry, grid=None, transform=gen_graphics.VIEW, route_prefix=ROUTE_PREFIX):
+        self._grid = grid if grid is not None else projection.GridProjection()
+        self._transform = transform
+        lines = {}  # route prefix -> enabled lines
+        for line in geometry['lines']:
+            if line['enabled']:
+                lines.setdefault(line['name'].split('_')[0], []).append(line)
+        self._tracks = {}  # route -> [track.Track]
+        self._index = {}   # route -> projection.TrackIndex
+        for route, prefix in route_prefix.items():
+            tracks = [t for line in lines.get(prefix, []) for t in gen_graphics.LineTracks(line)]
+            if tracks:
+                self._tracks[route] = tracks
+                self._index[route] = projection.TrackIndex(tracks)
+
+    def Place(self, lat, lon, routes):
+        """ Returns an (N, 2) array of view coordinates.  'routes' is the Train Tracker
+            route code of each train; trains of routes without drawn track stay unsnapped. """
+        view = self._transform.ToView(self._grid.ToAddress(lat, lon))
+        routes = np.asarray(routes, dtype=object)
+        for route, index in self._index.items():
+            mine = np.flatnonzero(routes == route)
+            if not len(mine):
+                continue
+            owner, offset, gap = index.Snap(view[mine])
+            near = gap <= SNAP_TRACK
+            for i, o, d in zip(mine[near], owner[near], offset[near]):
+                track = self._tracks[route][o]
+                point, heading = track.At(d)
+                if not _Beyond(track, d, point, heading, view[i]):
+                    view[i] = point
+        return view
+
+def _Beyond(track, distance, point, heading, position):
+    """ True if 'position' lies more than SNAP_END past the end of 'track' it was
+        snapped to ('point' at 'distance', with 'heading') """
+    if 0 < distance < track.Length():
+        return False
+    if distance <= 0:
+        heading += 180   # Outward from the start is backwards
+    a = np.radians(heading)
+    return (position[0] - point[0]) * np.cos(a) + (position[1] - point[1]) * np.sin(a) > SNAP_END
+
+def StationElements(geometry, stationdata, grid=None):
+    """ Returns {GTFS station id: marker element id} for the stations of the
+        station export (or station_model.StationModel) that are drawn on the map.
+        Named stations (lines.json el_stations) are matched by their GTFS ids, the
+        rest by position since the Loop is drawn schematically """
+    grid = grid if grid is not None else projection.GridProjection()
+    gtfs = projection.StationIndex.FromStations(stationdata, grid)
+    served = set(gtfs.station_ids.tolist())
+    markers = {}
+    unnamed = {}
+    for line in geometry['lines']:
+        if line['enabled']:
+            for station in line['stations']:
+                name = station[4]
+                if name is None:
+                    unnamed[gen_graphics.StationId(station)] = station[0]
+                else:
+                    for sid in geometry['el_stations'][name].get('gtfs', []):
+                        if sid in served:
+                            markers[sid] = gen_graphics.StationId(station)
+    if unnamed:
+        index = projection.StationIndex(list(unnamed), list(unnamed.values()))
+        ids, _ = index.Snap(gtfs.positions, max_distance=SNAP_STATION)
+        for sid, eid in zip(gtfs.station_ids, ids):
+            if eid is not None:
+                markers.setdefault(sid, eid)
+    return markers
+
+def Diff(previous, current):
+    """ Returns the patch turning frame 'previous' into 'current'.  Frames are
+        {element id: {attribute: value}} """
+    patch = []
+    for eid, attrs in current.items():
+        old = previous.get(eid)
+        if old is None:
+            patch.append({'op': 'add', 'id': eid, 'attrs': attrs})
+        elif old != attrs:
+            patch.append({'op': 'set', 'id': eid,
+                          'attrs': {k: v for k, v in attrs.items() if old.get(k) != v}})
+    for eid in previous:
+        if eid not in current:
+            patch.append({'op': 'remove', 'id': eid})
+    return patch
+
+def Apply(frame, patch):
+    """ Applies a patch to a frame in place, as a display client would """
+    for op in patch:
+        if op['op'] == 'remove':
+            del frame[op['id']]
+        elif op['op'] == 'add':
+            frame[op['id']] = dict(op['attrs'])
+        else:
+            frame[op['id']].update(op['attrs'])
+    return frame
+
+class LiveMap:
+    """ Base layer rendering and per frame patches for the live display.  Station markers
+        are matched to GTFS stations by StationElements(); 'markers' ({GTFS station id:
+        marker element id}) adds to or overrides that. """
+    def __init__(self, stationdata=None, geometry=None, grid=None, markers=None):
+        self._geometry = geometry if geometry is not None else gen_graphics.LoadGeometry()
+        grid = grid if grid is not None else projection.GridProjection()
+        self._placer = TrainPlacer(self._geometry, grid)
+        self._stations = StationElements(self._geometry, stationdata, grid) if stationdata else {}
+        self._stations.update(markers or {})
+        self.frame = {}
+
+    def RenderBase(self, filename, backend='fast'):
+        """ Writes the static map with an empty trains layer on top """
+        dwg = gen_graphics.NewDrawing(filename, backend=backend)
+        gen_graphics.DrawMap(dwg, geometry=self._geometry)
+        dwg.add(dwg.g(id='trains'))
+        dwg.save()
+
+    def Frame(self, snapshot):
+        """ Returns the dynamic state for a train_tracker.Snapshot """
+        frame = {}
+        trains = [t for t in snapshot.Trains().values() if t.get('lat') is not None]
+        if trains:
+            points = self._placer.Place([t['lat'] for t in trains], [t['lon'] for t in trains],
+                                        [t['route'] for t in trains])
+            for train, (x, y) in zip(trains, points.round(PRECISION).tolist()):
+                frame['train_' + train['rn']] = {'x': x, 'y': y, 'route': train['route']}
+        approaching = {t.get('nextStaId') for t in trains if t.get('isApp') == '1'}
+        for sid, eid in self._stations.items():
+            state = 'approaching' if sid in approaching else 'idle'
+            # Several GTFS stations can share one marker, any approach wins
+            if frame.get(eid, {}).get('class') != 'approaching':
+                frame[eid] = {'class': state}
+        return frame
+
+    def Update(self, snapshot):
+        """ Returns the patch from the previous frame to the one for 'snapshot' """
+        frame = self.Frame(snapshot)
+        patch = Diff(self.frame, frame)
+        self.frame = frame
+        return patch
+
+async def Stream(live, poller, period, out):
+    """ Writes one JSON patch per line every 'period' seconds while polling """
+    polling = asyncio.create_task(poller.Run())
+    try:
+        while True:
+            await asyncio.sleep(period)
+            patch = live.Update(poller.snapshot)
+            if patch:
+                out.write(json.dumps(patch) + '\n')
+                out.flush()
+    finally:
+        polling.cancel()
+
+if __name__ == '__main__':
+    # Only the command line polls, the rest of the module works without aiohttp
+    import train_tracker
+    parser = argparse.ArgumentParser(description='Stream live map patches')
+    parser.add_argument('--base', default='base.svg', help='static base layer to write (default: %(default)s)')
+    parser.add_argument('--stations', help='station export (JSON or compact), enables station states')
+    parser.add_argument('--markers', help='JSON {GTFS station id: marker element id} overrides')
+    parser.add_argument('--key', help='API key (default: TRAIN_TRACKER_KEY from creds.py)')
+    parser.add_argument('--url', default=train_tracker.API_URL, help='positions endpoint')
+    parser.add_argument('--period', type=float, default=5.0, help='seconds between frames (default: %(default)s)')
+    args = parser.parse_args()
+
+    stationdata = None
+    if args.stations:
+        import station_model
+        stationdata = station_model.read_stations(args.stations)
+    markers = None
+    if args.markers:
+        with open(args.markers) as fh:
+            markers = json.load(fh)
+    key = args.key
+    if key is None:
+        import creds
+        key = creds.TRAIN_TRACKER_KEY
+
+    live = LiveMap(stationdata, markers=markers)
+    live.RenderBase(args.base)
+    poller = train_tracker.Poller(key, url=args.url)
+    try:
+        asyncio.run(Stream(live, poller, args.period, sys.stdout))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,172 @@
+import numpy as np
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+# Bridges GTFS positions (stop_lat/stop_lon from get_station_data.py, or live
+# vehicle positions) and the Chicago street address grid gen_graphics.py draws
+# in.  East/west the grid is 800 addresses per mile everywhere, so East is a
+# linear fit.  North/south it is not: Madison to Roosevelt (1200 S) is one
+# mile but every mile south of 39th is 800.  North is therefore interpolated
+# piecewise linearly between calibration stations.
+
+# Stations at known grid intersections: stop_id -> (lat, lon, [East, North] address)
+CALIBRATION = {
+    '40900': (42.019063, -87.672892, [-1700, 7600]), # Howard: Howard & Paulina
+    '41290': (41.967901, -87.713065, [-3400, 4800]), # Kimball: Kimball & Lawrence
+    '40380': (41.885737, -87.630886, [-100, 200]),   # Clark/Lake: Clark & Lake
+    '40260': (41.885740, -87.627835, [0, 200]),      # State/Lake: State & Lake
+    '40020': (41.886848, -87.803176, [-7200, 200]),  # Harlem/Lake: Harlem & Lake
+    '41400': (41.867368, -87.627402, [0, -1200]),    # Roosevelt: State & Roosevelt
+    '41000': (41.853206, -87.630968, [-200, -2200]), # Cermak-Chinatown: Wentworth & Cermak
+    '40190': (41.831191, -87.630636, [-200, -3500]), # Sox-35th: Wentworth & 35th
+    '41230': (41.810318, -87.630940, [-200, -4700]), # 47th: Wentworth & 47th
+    '40910': (41.780536, -87.630952, [-200, -6300]), # 63rd: Wentworth & 63rd
+    '40290': (41.778860, -87.663766, [-1600, -6300]),# Ashland/63rd: Ashland & 63rd
+    '40720': (41.780309, -87.605857, [800, -6300]),  # Cottage Grove: Cottage Grove & 63rd
+    '40240': (41.750419, -87.625112, [0, -7900]),    # 79th: State & 79th
+    '40450': (41.722377, -87.624342, [0, -9500]),    # 95th/Dan Ryan: State & 95th
+}
+
+def _knots(values, targets):
+    """ Sorted, de-duplicated (value, target) knots for np.interp """
+    knots = {}
+    for v, t in zip(values, targets):
+        knots.setdefault(t, []).append(v)
+    pairs = sorted((np.mean(v), t) for t, v in knots.items())
+    x = np.array([p[0] for p in pairs])
+    y = np.array([p[1] for p in pairs], dtype=float)
+    if len(pairs) < 2:
+        raise ValueError("Calibration stations need at least 2 distinct North addresses, found {}"
+                         .format(len(pairs)))
+    if np.any(np.diff(y) <= 0):
+        raise ValueError("Calibration stations are not monotonic north to south")
+    return x, y
+
+def _interp(v, x, y):
+    """ np.interp() that extrapolates linearly past both ends """
+    out = np.interp(v, x, y)
+    low = (y[1] - y[0]) / (x[1] - x[0])
+    high = (y[-1] - y[-2]) / (x[-1] - x[-2])
+    out = np.where(v < x[0], y[0] + (v - x[0]) * low, out)
+    return np.where(v > x[-1], y[-1] + (v - x[-1]) * high, out)
+
+class GridProjection:
+    """ lat/lon <-> street address projection calibrated against known stations """
+    def __init__(self, calibration=CALIBRATION):
+        lat = np.array([c[0] for c in calibration.values()])
+        lon = np.array([c[1] for c in calibration.values()])
+        address = np.array([c[2] for c in calibration.values()], dtype=float)
+        self._lat, self._north = _knots(lat, address[:, 1])
+        # East = [lon, lat, 1] @ east  (lat term absorbs any tilt of the grid)
+        design = np.column_stack([lon, lat, np.ones_like(lat)])
+        if len(np.unique(address[:, 0])) < 2 or np.linalg.matrix_rank(design) < 3:
+            raise ValueError("Calibration stations need at least 2 distinct East addresses "
+                             "and must not lie on one line")
+        self._east, _, _, _ = np.linalg.lstsq(design, address[:, 0], rcond=None)
+        self.residual = np.abs(self.ToAddress(lat, lon) - address).max(axis=0)
+
+    @staticmethod
+    def FromStations(stationdata, addresses):
+        """ Calibrates against a station export (get_station_data.py output) or a
+            station_model.StationModel given {station_id: [East, North]} for some
+            of its stations """
+        calibration = {}
+        if hasattr(stationdata, 'stop_ids'):
+            for sid in addresses:
+                try:
+                    i = stationdata.index_of(sid)
+                except KeyError:
+                    continue
+                calibration[sid] = (float(stationdata.lat[i]), float(stationdata.lon[i]), addresses[sid])
+            stationdata = []
+        for route in stationdata:
+            for s in route['stations']:
+                if s['stop_id'] in addresses:
+                    calibration[s['stop_id']] = (s['stop_lat'], s['stop_lon'], addresses[s['stop_id']])
+        if len(calibration) < 3:
+            raise ValueError("Need at least 3 calibration stations, found {}".format(len(calibration)))
+        return GridProjection(calibration)
+
+    def ToAddress(self, lat, lon):
+        """ Arrays of lat and lon -> (N, 2) array of [East, North] addresses """
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        east = self._east[0] * lon + self._east[1] * lat + self._east[2]
+        return np.stack([east, _interp(lat, self._lat, self._north)], axis=-1)
+
+    def ToLatLon(self, addresses):
+        """ (N, 2) array of addresses -> (N, 2) array of [lat, lon] """
+        addresses = np.asarray(addresses, dtype=float)
+        lat = _interp(addresses[..., 1], self._north, self._lat)
+        lon = (addresses[..., 0] - self._east[1] * lat - self._east[2]) / self._east[0]
+        return np.stack([lat, lon], axis=-1)
+
+class _BruteTree:
+    """ Stand-in for cKDTree.query() when scipy is not installed """
+    def __init__(self, points):
+        self._points = points
+
+    def query(self, x, distance_upper_bound=np.inf):
+        x = np.asarray(x, dtype=float)
+        d = np.linalg.norm(x[:, None, :] - self._points[None, :, :], axis=2)
+        index = d.argmin(axis=1)
+        dist = d[np.arange(len(x)), index]
+        missing = dist > distance_upper_bound
+        return np.where(missing, np.inf, dist), np.where(missing, len(self._points), index)
+
+def _tree(points):
+    return cKDTree(points) if cKDTree is not None else _BruteTree(points)
+
+class StationIndex:
+    """ Spatial index over station positions for snapping many points at once """
+    def __init__(self, station_ids, positions):
+        self.station_ids = np.asarray(station_ids)
+        self.positions = np.asarray(positions, dtype=float)
+        self._tree = _tree(self.positions)
+
+    @staticmethod
+    def FromStations(stationdata, projection):
+        """ Builds an index in address space from a station export or a
+            station_model.StationModel """
+        if hasattr(stationdata, 'stop_ids'):
+            # Already one entry per station, sorted by id
+            return StationIndex(list(stationdata.stop_ids),
+                                projection.ToAddress(np.asarray(stationdata.lat), np.asarray(stationdata.lon)))
+        stations = {}
+        for route in stationdata:
+            for s in route['stations']:
+                stations[s['stop_id']] = (s['stop_lat'], s['stop_lon'])
+        ids = sorted(stations)
+        lat, lon = np.array([stations[i] for i in ids]).T
+        return StationIndex(ids, projection.ToAddress(lat, lon))
+
+    def Snap(self, points, max_distance=np.inf):
+        """ Returns (station ids, distances) of the nearest station to each point.
+            Points further than max_distance from any station get id None. """
+        dist, index = self._tree.query(np.asarray(points, dtype=float), distance_upper_bound=max_distance)
+        found = index < len(self.station_ids)
+        ids = np.where(found, self.station_ids[np.minimum(index, len(self.station_ids) - 1)], None)
+        return ids, dist
+
+class TrackIndex:
+    """ Spatial index over points sampled every 'spacing' along a set of
+        track.Track objects.  Snaps points to (track index, distance along it). """
+    def __init__(self, tracks, spacing=1.0):
+        samples, owners, offsets = [], [], []
+        for i, t in enumerate(tracks):
+            d = np.append(np.arange(0.0, t.Length(), spacing), t.Length())
+            points, _ = t.AtMany(d)
+            samples.append(points)
+            owners.append(np.full(len(d), i))
+            offsets.append(d)
+        self._points = np.concatenate(samples)
+        self._owner = np.concatenate(owners)
+        self._offset = np.concatenate(offsets)
+        self._tree = _tree(self._points)
+
+    def Snap(self, points):
+        """ Returns (track indexes, distances along track, distances from track) """
+        dist, index = self._tree.query(np.asarray(points, dtype=float))
+        return self._owner[index], self._offset[index], dist
@@ -0,0 +1,86 @@
+import hashlib
+import json
+from get_station_data import route_stations
+
+# Incremental station export.  Each route's station set is fingerprinted
+# (every field of every station record) both in the previous export and in
+# the new feed.  On the feed side each station row is hashed once, however
+# many routes serve it, and the hashes are combined per route.  Only routes
+# whose fingerprint changed get their station records built; everything else
+# is carried over from the previous export.
+# The diff lists, per changed route, the stations that were added, removed,
+# moved, or had any other field (e.g. stop_name) updated:
+# { 'routes_added': ['Y'],
+#   'routes_removed': [],
+#   'changed': {
+#     'G': { 'added': ['41690'], 'removed': [], 'moved': ['40020'], 'updated': [] },
+#   }
+# }
+
+def _position(record):
+  return ('%.6f' % record['stop_lat'], '%.6f' % record['stop_lon'])
+
+def _digest(record):
+  """ Hash of all fields of a station record """
+  return hashlib.sha1(json.dumps(record, sort_keys=True, default=str).encode()).hexdigest()
+
+def fingerprint(digests):
+  """ Returns a fingerprint for an iterable of (station_id, _digest()) pairs """
+  digest = hashlib.sha1()
+  for sid, record in sorted(digests):
+    digest.update(('%s,%s;' % (sid, record)).encode())
+  return digest.hexdigest()
+
+def export_fingerprints(stationdata):
+  """ Returns {route_id: (fingerprint, {station_id: record})} for an export """
+  return {route['route_id']: (fingerprint((s['stop_id'], _digest(s)) for s in route['stations']),
+                              {s['stop_id']: s for s in route['stations']})
+          for route in stationdata}
+
+def feed_fingerprints(by_route, digests):
+  """ Returns {route_id: fingerprint} given {route_id: [station_id]} and
+      {station_id: _digest()} for the feed """
+  return {rid: fingerprint((sid, digests[sid]) for sid in sids)
+          for rid, sids in by_route.items()}
+
+def incremental_export(previous, routes, trips, stop_times, stops):
+  """ Returns (stationdata, diff) for a new feed given the previous export.
+      Stations of unchanged routes are reused from 'previous' """
+  pairs = route_stations(routes, trips, stop_times, stops)
+  stops_by_id = stops.set_index('stop_id', drop=False)
+  rows = stops_by_id.loc[pairs.station_id.unique()].to_dict('index')
+  digests = {sid: _digest(row) for sid, row in rows.items()}
+  rail = routes[routes.route_type == 1].to_dict('records')
+  # Every rail route is exported, so every rail route is fingerprinted; one
+  # without trips has no stations and gets the fingerprint of an empty set
+  by_route = {rid: sorted(sids) for rid, sids in pairs.groupby('route_id').station_id}
+  by_route = {route['route_id']: by_route.get(route['route_id'], []) for route in rail}
+  old = export_fingerprints(previous)
+  new = feed_fingerprints(by_route, digests)
+  old_stations = {r['route_id']: r['stations'] for r in previous}
+
+  diff = {'routes_added': sorted(set(new) - set(old)),
+          'routes_removed': sorted(set(old) - set(new)),
+          'changed': {}}
+  stationdata = []
+  for route in rail:
+    rid = route['route_id']
+    new_print = new[rid]
+    old_print, old_records = old.get(rid, (None, {}))
+    if new_print == old_print:
+      route['stations'] = old_stations[rid]
+    else:
+      sids = by_route[rid]
+      route['stations'] = [dict(rows[sid]) for sid in sids]
+      common = set(sids) & set(old_records)
+      moved = {sid for sid in common
+               if _position(rows[sid]) != _position(old_records[sid])}
+      diff['changed'][rid] = {
+        'added': sorted(set(sids) - set(old_records)),
+        'removed': sorted(set(old_records) - set(sids)),
+        'moved': sorted(moved),
+        'updated': sorted(sid for sid in common - moved
+                          if digests[sid] != _digest(old_records[sid])),
+      }
+    stationdata.append(route)
+  return stationdata, diff
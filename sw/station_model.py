@@ -0,0 +1,205 @@
+import json
+import mmap
+import numpy as np
+from get_station_data import route_stations
+
+# Compact station/route model.  The JSON export copies every GTFS column of a
+# station into each route that serves it; here each station is stored once and
+# routes hold integer indexes into the station arrays:
+#
+#   stop_ids, names      strings, station i is stop_ids[i] (names may be None)
+#   lat, lon             float64 arrays
+#   route_offsets        int32, route r serves route_stations[route_offsets[r]:route_offsets[r+1]]
+#   route_stations       int32 station indexes
+#
+# save() writes it as one binary file: an 8 byte magic, a little endian uint32
+# header length, a JSON header (route records and array layout), then the
+# arrays, each 8 byte aligned.  load() memory maps the file, so the arrays are
+# paged in on use and strings are only decoded when looked up.  pandas is
+# only needed to build a model from GTFS tables, not to load one.
+# train_tracker.Snapshot.FromStations() and live_frame.StationElements()
+# take a StationModel directly, reading just stop_ids, lat and lon.
+
+MAGIC = b'CTASTN2\0'
+ALIGN = 8
+
+class Station:
+  """ One station of a StationModel """
+  __slots__ = ('index', 'stop_id', 'stop_name', 'stop_lat', 'stop_lon')
+
+  def __init__(self, index, stop_id, stop_name, stop_lat, stop_lon):
+    self.index = index
+    self.stop_id = stop_id
+    self.stop_name = stop_name
+    self.stop_lat = stop_lat
+    self.stop_lon = stop_lon
+
+  def __repr__(self):
+    return 'Station(%d, %r, %r)' % (self.index, self.stop_id, self.stop_name)
+
+class Strings:
+  """ Read only list of strings (or None) stored as one utf-8 blob plus offsets
+      and a missing value mask """
+  def __init__(self, blob, offsets, missing):
+    self._blob = blob
+    self._offsets = offsets
+    self._missing = missing
+    self._index = None
+
+  @staticmethod
+  def pack(values):
+    """ Returns (blob, offsets, missing) arrays for a list of strings """
+    encoded = [('' if v is None else str(v)).encode() for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int32)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    missing = np.array([v is None for v in values], dtype=np.uint8)
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets, missing
+
+  def __len__(self):
+    return len(self._offsets) - 1
+
+  def __getitem__(self, i):
+    if self._missing[i]:
+      return None
+    return bytes(self._blob[self._offsets[i]:self._offsets[i + 1]]).decode()
+
+  def __iter__(self):
+    return (self[i] for i in range(len(self)))
+
+  def index(self, value):
+    """ Position of 'value', the lookup table is built on first use """
+    if self._index is None:
+      self._index = {s: i for i, s in enumerate(self)}
+    return self._index[value]
+
+class StationModel:
+  """ Stations interned once, routes as station index lists """
+  def __init__(self, routes, stop_ids, names, lat, lon, route_offsets, route_stations):
+    self.routes = routes              # GTFS route records, without stations
+    self.stop_ids = stop_ids          # Strings
+    self.names = names                # Strings
+    self.lat = lat
+    self.lon = lon
+    self.route_offsets = route_offsets
+    self.route_stations = route_stations
+    self._route_index = {r['route_id']: i for i, r in enumerate(routes)}
+
+  @staticmethod
+  def _build(routes, by_route, stations):
+    """ routes: route records, by_route: {route_id: [stop_id]},
+        stations: {stop_id: (name, lat, lon)} """
+    ids = sorted(stations)
+    index = {sid: i for i, sid in enumerate(ids)}
+    members = [[index[sid] for sid in by_route.get(r['route_id'], [])] for r in routes]
+    offsets = np.zeros(len(routes) + 1, dtype=np.int32)
+    np.cumsum([len(m) for m in members], out=offsets[1:])
+    flat = np.array([i for m in members for i in m], dtype=np.int32)
+    return StationModel(routes, Strings(*Strings.pack(ids)),
+                        Strings(*Strings.pack([stations[s][0] for s in ids])),
+                        np.array([stations[s][1] for s in ids], dtype=np.float64),
+                        np.array([stations[s][2] for s in ids], dtype=np.float64),
+                        offsets, flat)
+
+  @staticmethod
+  def from_tables(routes, trips, stop_times, stops):
+    """ Builds the model straight from GTFS tables, see get_station_data.extract_stations() """
+    import pandas as pd
+    pairs = route_stations(routes, trips, stop_times, stops)
+    rows = (stops.set_index('stop_id').loc[pairs.station_id.unique(), ['stop_name', 'stop_lat', 'stop_lon']])
+    stations = {sid: (None if pd.isna(row.stop_name) else row.stop_name, float(row.stop_lat), float(row.stop_lon))
+                for sid, row in zip(rows.index, rows.itertuples())}
+    by_route = {rid: sorted(sids) for rid, sids in pairs.groupby('route_id').station_id}
+    records = [{k: (None if pd.isna(v) else v) for k, v in r.items()}
+               for r in routes[routes.route_type == 1].to_dict('records')]
+    return StationModel._build(records, by_route, stations)
+
+  @staticmethod
+  def from_export(stationdata):
+    """ Builds the model from a station export (get_station_data.py output) """
+    routes, by_route, stations = [], {}, {}
+    for route in stationdata:
+      routes.append({k: v for k, v in route.items() if k != 'stations'})
+      by_route[route['route_id']] = [s['stop_id'] for s in route['stations']]
+      for s in route['stations']:
+        stations[s['stop_id']] = (s.get('stop_name'), s['stop_lat'], s['stop_lon'])
+    return StationModel._build(routes, by_route, stations)
+
+  def __len__(self):
+    return len(self.stop_ids)
+
+  def station(self, i):
+    """ Station at index i """
+    return Station(i, self.stop_ids[i], self.names[i], float(self.lat[i]), float(self.lon[i]))
+
+  def index_of(self, stop_id):
+    return self.stop_ids.index(stop_id)
+
+  def route(self, route_id):
+    """ Station indexes served by a route """
+    r = self._route_index[route_id]
+    return self.route_stations[self.route_offsets[r]:self.route_offsets[r + 1]]
+
+  def to_export(self):
+    """ Returns the station export format with only the stop_id, stop_name,
+        stop_lat and stop_lon station fields """
+    stationdata = []
+    for route in self.routes:
+      stations = [self.station(int(i)) for i in self.route(route['route_id'])]
+      stationdata.append(dict(route, stations=[{'stop_id': s.stop_id, 'stop_name': s.stop_name,
+                                                 'stop_lat': s.stop_lat, 'stop_lon': s.stop_lon}
+                                                for s in stations]))
+    return stationdata
+
+  def save(self, path):
+    """ Writes the compact binary form """
+    arrays = {
+      'lat': self.lat, 'lon': self.lon,
+      'route_offsets': self.route_offsets, 'route_stations': self.route_stations,
+    }
+    arrays['stop_ids'], arrays['stop_id_offsets'], arrays['stop_id_missing'] = Strings.pack(list(self.stop_ids))
+    arrays['names'], arrays['name_offsets'], arrays['name_missing'] = Strings.pack(list(self.names))
+
+    layout, position = {}, 0
+    for name, a in arrays.items():
+      position += -position % ALIGN
+      layout[name] = [a.dtype.str, position, len(a)]
+      position += a.nbytes
+    header = json.dumps({'routes': self.routes, 'arrays': layout}).encode()
+    start = len(MAGIC) + 4 + len(header)
+    start += -start % ALIGN
+    with open(path, 'wb') as fh:
+      fh.write(MAGIC)
+      fh.write(np.uint32(len(header)).astype('<u4').tobytes())
+      fh.write(header)
+      for name, a in arrays.items():
+        fh.seek(start + layout[name][1])
+        fh.write(np.ascontiguousarray(a).tobytes())
+
+def load(path):
+  """ Memory maps a file written by StationModel.save() """
+  with open(path, 'rb') as fh:
+    data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+  if data[:len(MAGIC)] != MAGIC:
+    raise ValueError("{} is not a compact station file".format(path))
+  size = int(np.frombuffer(data, dtype='<u4', count=1, offset=len(MAGIC))[0])
+  header = json.loads(data[len(MAGIC) + 4:len(MAGIC) + 4 + size])
+  start = len(MAGIC) + 4 + size
+  start += -start % ALIGN
+  # Empty arrays can sit past the end of the file, they have nothing to map
+  a = {name: np.frombuffer(data, dtype=dtype, count=count, offset=start + offset)
+             if count else np.zeros(0, dtype=dtype)
+       for name, (dtype, offset, count) in header['arrays'].items()}
+  return StationModel(header['routes'],
+                      Strings(a['stop_ids'], a['stop_id_offsets'], a['stop_id_missing']),
+                      Strings(a['names'], a['name_offsets'], a['name_missing']), a['lat'], a['lon'],
+                      a['route_offsets'], a['route_stations'])
+
+def read_stations(path):
+  """ Returns the station export of a JSON export file, or the memory mapped
+      StationModel of a compact file """
+  with open(path, 'rb') as fh:
+    compact = fh.read(len(MAGIC)) == MAGIC
+  if compact:
+    return load(path)
+  with open(path) as fh:
+    return json.load(fh)
@@ -0,0 +1,199 @@
+from xml.sax.saxutils import escape
+
+# Minimal stand-in for the part of svgwrite used by gen_graphics.py.  Elements
+# are plain objects that are only formatted when the drawing is written, and
+# nothing is validated unless debug=True (intended for tests).  Swap it in for
+# svgwrite.Drawing when rendering many maps:
+#
+#   dwg = svgfast.Drawing(filename='graphic.svg')
+#
+# 'python svgfast.py' renders the map with validation on and checks that
+# invalid attributes and children are rejected.
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+
+# Attributes accepted per element when debug=True
+PRESENTATION = {'id', 'stroke', 'stroke-width', 'fill', 'fill-opacity', 'stroke-opacity',
+                'opacity', 'stroke-linecap', 'stroke-linejoin', 'transform', 'class'}
+ATTRIBUTES = {
+    'svg': {'baseProfile', 'version', 'width', 'height', 'viewBox', 'xmlns', 'xmlns:ev',
+            'xmlns:xlink'},
+    'defs': set(),
+    'g': set(),
+    'path': {'d'},
+    'circle': {'cx', 'cy', 'r'},
+    'rect': {'x', 'y', 'width', 'height', 'rx', 'ry'},
+    'use': {'x', 'y', 'xlink:href'},
+}
+CHILDREN = {
+    'svg': {'defs', 'g', 'path', 'circle', 'rect', 'use'},
+    'defs': {'g', 'path', 'circle'},
+    'g': {'g', 'path', 'circle', 'rect', 'use'},
+    'path': set(),
+    'circle': set(),
+    'rect': set(),
+    'use': set(),
+}
+
+def _name(key):
+    """ Converts a python keyword into an SVG attribute name like svgwrite does """
+    return key.rstrip('_').replace('_', '-')
+
+def _value(value):
+    if isinstance(value, float):
+        return '%g' % value
+    return escape(str(value), {'"': '&quot;'})
+
+class Element:
+    """ SVG element with attributes and children """
+    def __init__(self, tag, debug=False, **extra):
+        self.tag = tag
+        self.debug = debug
+        self.attribs = {}
+        self.elements = []
+        for key, value in extra.items():
+            self[_name(key)] = value
+
+    def __getitem__(self, key):
+        return self.attribs[key]
+
+    def __setitem__(self, key, value):
+        if self.debug:
+            if key not in PRESENTATION and key not in ATTRIBUTES[self.tag]:
+                raise ValueError("Invalid attribute '{}' for <{}>".format(key, self.tag))
+            if isinstance(value, float) and value != value:
+                raise ValueError("Invalid value {} for '{}'".format(value, key))
+        self.attribs[key] = value
+
+    def add(self, element):
+        """ Appends a child element and returns it """
+        if self.debug and element.tag not in CHILDREN[self.tag]:
+            raise ValueError("<{}> is not a valid child of <{}>".format(element.tag, self.tag))
+        self.elements.append(element)
+        return element
+
+    def write(self, out):
+        out.write('<' + self.tag)
+        for key, value in self.attribs.items():
+            out.write(' %s="%s"' % (key, _value(value)))
+        if self.elements:
+            out.write('>')
+            for element in self.elements:
+                element.write(out)
+            out.write('</%s>' % self.tag)
+        else:
+            out.write('/>')
+
+class Path(Element):
+    """ <path> whose data is built up with push() like svgwrite's Path """
+    def __init__(self, d=None, debug=False, **extra):
+        super().__init__('path', debug=debug, **extra)
+        self.commands = []
+        if d is not None:
+            self.push(d)
+
+    def push(self, *commands):
+        self.commands.extend(commands)
+
+    def write(self, out):
+        self.attribs['d'] = ' '.join(self.commands)
+        super().write(out)
+
+class Drawing(Element):
+    """ Drop-in for svgwrite.Drawing covering the elements gen_graphics.py uses """
+    def __init__(self, filename='noname.svg', size=('100%', '100%'), profile='tiny',
+                 debug=False, **extra):
+        super().__init__('svg', debug=debug, **extra)
+        self.filename = filename
+        self['baseProfile'] = profile
+        self['version'] = '1.2' if profile == 'tiny' else '1.1'
+        self['width'], self['height'] = size
+        self['xmlns'] = SVG_NS
+        self['xmlns:xlink'] = XLINK_NS
+        self.defs = Element('defs', debug=debug)
+
+    def g(self, **extra):
+        return Element('g', debug=self.debug, **extra)
+
+    def path(self, d=None, **extra):
+        return Path(d, debug=self.debug, **extra)
+
+    def circle(self, center=(0, 0), r=1, **extra):
+        return Element('circle', debug=self.debug, cx=center[0], cy=center[1], r=r, **extra)
+
+    def rect(self, insert=(0, 0), size=(1, 1), **extra):
+        return Element('rect', debug=self.debug, x=insert[0], y=insert[1], width=size[0],
+                       height=size[1], **extra)
+
+    def use(self, href, insert=None, **extra):
+        if isinstance(href, Element):
+            href = '#' + href['id']
+        element = Element('use', debug=self.debug, **extra)
+        element['xlink:href'] = href
+        if insert is not None:
+            element['x'], element['y'] = insert
+        return element
+
+    def viewbox(self, minx=0, miny=0, width=0, height=0):
+        self['viewBox'] = '%s,%s,%s,%s' % (minx, miny, width, height)
+
+    def write(self, out):
+        out.write('<?xml version="1.0" encoding="utf-8" ?>\n<svg')
+        for key, value in self.attribs.items():
+            out.write(' %s="%s"' % (key, _value(value)))
+        out.write('>')
+        if self.defs.elements:
+            self.defs.write(out)
+        for element in self.elements:
+            element.write(out)
+        out.write('</svg>')
+
+    def tostring(self):
+        chunks = []
+        self.write(_Collect(chunks))
+        return ''.join(chunks)
+
+    def save(self):
+        with open(self.filename, 'w', encoding='utf-8', buffering=1 << 16) as out:
+            self.write(out)
+
+class _Collect:
+    """ Write target that gathers chunks for tostring() """
+    def __init__(self, chunks):
+        self.write = chunks.append
+
+def Check():
+    """ Returns a list of failures: the map must render with debug=True and
+        invalid attributes and children must raise ValueError """
+    import gen_graphics
+    failures = []
+    dwg = gen_graphics.NewDrawing('check.svg', backend='fast', debug=True)
+    try:
+        gen_graphics.DrawMap(dwg)
+        dwg.tostring()
+    except ValueError as e:
+        failures.append('DrawMap: %s' % e)
+
+    bad = {
+        'attribute': lambda: dwg.circle((0, 0), r=1, width=2),
+        'attribute value': lambda: dwg.rect((0, 0), (float('nan'), 1)),
+        'child': lambda: dwg.defs.add(dwg.rect()),
+        'child of path': lambda: dwg.path(d='M 0 0').add(dwg.circle()),
+    }
+    for case, build in bad.items():
+        try:
+            build()
+        except ValueError:
+            continue
+        failures.append('invalid %s was accepted' % case)
+    return failures
+
+if __name__ == '__main__':
+    import sys
+    failures = Check()
+    for f in failures:
+        print('FAIL ' + f, file=sys.stderr)
+    if failures:
+        sys.exit(1)
+    print('ok')
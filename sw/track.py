@@ -0,0 +1,148 @@
+import bisect
+import math
+import numpy as np
+
+# Arc length parameterized record of a drawn train line.  TrainLine appends a
+# straight segment or circular arc for every DrawBlocks/DrawToAddress/DrawTurn
+# so that once a line is drawn any point along it can be found by distance:
+#
+#   point, heading = line.Track().At(d)
+#
+# All values are in view coordinates.  Headings are degrees with 0 to the right
+# and positive angles clockwise, the same as TrainLine._angle.
+
+LINE = 0
+ARC = 1
+
+class Track:
+    """ Sequence of segments and arcs with cumulative lengths """
+    def __init__(self):
+        # One entry per piece.  For lines: (x0, y0, x1, y1), for arcs:
+        # (center x, center y, radius, start angle, sweep) with angles in degrees
+        self._kind = []
+        self._params = []
+        self._start = [] # distance along the track where each piece starts
+        self._length = 0.0
+        self._arrays = None
+
+    def AddLine(self, begin, end):
+        self._add(LINE, (begin[0], begin[1], end[0], end[1]),
+                  math.hypot(end[0] - begin[0], end[1] - begin[1]))
+
+    def AddArc(self, center, radius, start_angle, sweep):
+        """ Arc around 'center' beginning at 'start_angle' and turning 'sweep' degrees """
+        self._add(ARC, (center[0], center[1], radius, start_angle, sweep),
+                  radius * math.radians(abs(sweep)))
+
+    def _add(self, kind, params, length):
+        self._kind.append(kind)
+        self._params.append(params)
+        self._start.append(self._length)
+        self._length += length
+        self._arrays = None
+
+    def Length(self):
+        return self._length
+
+    def _piece(self, i, offset):
+        """ Returns (point, heading) 'offset' into piece i """
+        if self._kind[i] == LINE:
+            x0, y0, x1, y1 = self._params[i]
+            length = math.hypot(x1 - x0, y1 - y0)
+            t = offset / length if length else 0.0
+            return ([x0 + (x1 - x0) * t, y0 + (y1 - y0) * t],
+                    math.degrees(math.atan2(y1 - y0, x1 - x0)))
+        cx, cy, r, a0, sweep = self._params[i]
+        angle = a0 + math.copysign(math.degrees(offset / r), sweep)
+        a = math.radians(angle)
+        return ([cx + r * math.cos(a), cy + r * math.sin(a)],
+                angle + math.copysign(90, sweep))
+
+    def At(self, distance):
+        """ Returns (point, heading) at 'distance' along the track, found by
+            binary search over the piece start distances """
+        if not self._kind:
+            raise ValueError("Track is empty")
+        distance = min(max(distance, 0.0), self._length)
+        i = max(bisect.bisect_right(self._start, distance) - 1, 0)
+        return self._piece(i, distance - self._start[i])
+
+    def _build(self):
+        if self._arrays is None:
+            params = np.zeros((len(self._params), 5))
+            for i, p in enumerate(self._params):
+                params[i, :len(p)] = p
+            self._arrays = (np.array(self._kind), params, np.array(self._start))
+        return self._arrays
+
+    def AtMany(self, distances):
+        """ Vectorized At(): returns (points (N, 2), headings (N,)) for an
+            array of distances """
+        if not self._kind:
+            raise ValueError("Track is empty")
+        kind, params, start = self._build()
+        d = np.clip(np.asarray(distances, dtype=float), 0.0, self._length)
+        i = np.clip(np.searchsorted(start, d, side='right') - 1, 0, len(start) - 1)
+        offset = d - start[i]
+        p = params[i]
+        is_line = kind[i] == LINE
+
+        # Straight pieces: columns are x0, y0, x1, y1
+        dx, dy = p[:, 2] - p[:, 0], p[:, 3] - p[:, 1]
+        length = np.hypot(dx, dy)
+        t = np.divide(offset, length, out=np.zeros_like(offset), where=length > 0)
+        line_pts = np.stack([p[:, 0] + dx * t, p[:, 1] + dy * t], axis=1)
+        line_heading = np.degrees(np.arctan2(dy, dx))
+
+        # Arcs: columns are cx, cy, r, start angle, sweep
+        sign = np.where(p[:, 4] < 0, -1.0, 1.0)
+        r = np.where(is_line, 1.0, p[:, 2])
+        angle = p[:, 3] + sign * np.degrees(offset / r)
+        a = np.radians(angle)
+        arc_pts = np.stack([p[:, 0] + r * np.cos(a), p[:, 1] + r * np.sin(a)], axis=1)
+        arc_heading = angle + sign * 90
+
+        points = np.where(is_line[:, None], line_pts, arc_pts)
+        headings = np.where(is_line, line_heading, arc_heading)
+        return points, headings
+
+    def Project(self, point):
+        """ Returns (distance along the track, distance from the track) of the
+            closest point on the track to 'point' """
+        best = (None, math.inf)
+        px, py = point
+        for i, kind in enumerate(self._kind):
+            if kind == LINE:
+                x0, y0, x1, y1 = self._params[i]
+                dx, dy = x1 - x0, y1 - y0
+                length = math.hypot(dx, dy)
+                t = 0.0 if not length else min(max(((px - x0) * dx + (py - y0) * dy) / length**2, 0.0), 1.0)
+                offset = t * length
+                gap = math.hypot(x0 + dx * t - px, y0 + dy * t - py)
+            else:
+                cx, cy, r, a0, sweep = self._params[i]
+                turned = (math.degrees(math.atan2(py - cy, px - cx)) - a0) * math.copysign(1, sweep) % 360
+                if turned > abs(sweep):
+                    # Outside the arc, snap to whichever end is closer in angle
+                    turned = abs(sweep) if turned - abs(sweep) < 360 - turned else 0.0
+                offset = r * math.radians(turned)
+                a = math.radians(a0 + math.copysign(turned, sweep))
+                gap = math.hypot(cx + r * math.cos(a) - px, cy + r * math.sin(a) - py)
+            if gap < best[1]:
+                best = (self._start[i] + offset, gap)
+        return best
+
+    def ToList(self):
+        """ Returns the track as JSON friendly lists """
+        return [[k] + list(p) for k, p in zip(self._kind, self._params)]
+
+    @staticmethod
+    def FromList(pieces):
+        """ Rebuilds a Track from ToList() output """
+        track = Track()
+        for piece in pieces:
+            if piece[0] == LINE:
+                track.AddLine(piece[1:3], piece[3:5])
+            else:
+                track.AddArc(piece[1:3], piece[3], piece[4], piece[5])
+        return track
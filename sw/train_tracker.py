@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import statistics
+import time
+import aiohttp
+
+# Live train positions from the CTA Train Tracker API.  All rail routes are
+# polled concurrently over one pooled HTTP session, sharing a token bucket so
+# the whole poller stays inside the per-key rate limit.  Responses land in a
+# Snapshot keyed by the station ids of the station export (get_station_data.py
+# output); each train is filed under the station it is approaching.
+#
+# The API key comes from --key or TRAIN_TRACKER_KEY in creds.py (not in git).
+# fake_tracker.py serves recorded responses for testing offline:
+#
+#   python train_tracker.py --record recordings/ --duration 600
+#   python fake_tracker.py recordings/ &
+#   python train_tracker.py --url http://127.0.0.1:8080/api/1.0/ttpositions.aspx --key test
+
+API_URL = 'http://lapi.transitchicago.com/api/1.0/ttpositions.aspx'
+
+# Train Tracker route codes for the eight rail routes
+ROUTES = ['red', 'blue', 'brn', 'g', 'org', 'p', 'pink', 'y']
+
+# Default key allowance is 50,000 requests per day, a bit over 0.5/s
+RATE = 0.5
+BURST = 8
+INTERVAL = 15.0   # seconds between polls of the same route
+BACKOFF = 2.0     # first retry delay after an error, doubles up to BACKOFF_MAX
+BACKOFF_MAX = 120.0
+
+log = logging.getLogger('ctamap.tracker')
+
+class TokenBucket:
+    """ Allows 'rate' requests per second on average with bursts of up to 'burst' """
+    def __init__(self, rate=RATE, burst=BURST):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def Take(self):
+        """ Waits until a request may be made """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+class Snapshot:
+    """ Latest known trains, by run number and by the station they are approaching """
+    def __init__(self, station_ids=None):
+        self._station_ids = set(station_ids) if station_ids is not None else None
+        self._routes = {}   # route -> {run number: train}
+        self.updated = {}   # route -> API timestamp of the data
+
+    @staticmethod
+    def FromStations(stationdata):
+        """ Snapshot limited to the stations in a station export or a
+            station_model.StationModel """
+        if hasattr(stationdata, 'stop_ids'):
+            return Snapshot(stationdata.stop_ids)
+        return Snapshot(s['stop_id'] for route in stationdata for s in route['stations'])
+
+    def Update(self, route, trains, timestamp=None):
+        """ Replaces everything known about 'route' """
+        self._routes[route] = {t['rn']: t for t in trains}
+        self.updated[route] = timestamp
+
+    def Trains(self):
+        """ Returns {run number: train} for all routes """
+        trains = {}
+        for route in self._routes.values():
+            trains.update(route)
+        return trains
+
+    def ByStation(self):
+        """ Returns {station_id: [trains approaching it]} """
+        stations = {sid: [] for sid in self._station_ids} if self._station_ids is not None else {}
+        for route in self._routes.values():
+            for train in route.values():
+                sid = train.get('nextStaId')
+                if self._station_ids is None:
+                    stations.setdefault(sid, []).append(train)
+                elif sid in stations:
+                    stations[sid].append(train)
+        return stations
+
+def ParsePositions(body):
+    """ Returns (timestamp, trains) from a ttpositions JSON response """
+    data = json.loads(body)['ctatt']
+    if data.get('errCd', '0') != '0':
+        raise ValueError("Train Tracker error {}: {}".format(data.get('errCd'), data.get('errNm')))
+    trains = []
+    for route in data.get('route', []):
+        found = route.get('train', [])
+        # A route with a single train has a dict instead of a list
+        for train in ([found] if isinstance(found, dict) else found):
+            train = dict(train, route=route.get('@name'))
+            for field in ('lat', 'lon'):
+                if train.get(field) is not None:
+                    train[field] = float(train[field])
+            trains.append(train)
+    return data.get('tmst'), trains
+
+class Poller:
+    """ Polls the positions of every route into a Snapshot """
+    def __init__(self, key, snapshot=None, routes=ROUTES, url=API_URL, rate=RATE, burst=BURST,
+                 interval=INTERVAL, record=None):
+        self._key = key
+        self._url = url
+        self._routes = routes
+        self._interval = interval
+        self._bucket = TokenBucket(rate, burst)
+        self._record = record
+        self._validators = {} # route -> conditional request headers from the last response
+        self.snapshot = snapshot if snapshot is not None else Snapshot()
+        self.stats = {'requests': 0, 'not_modified': 0, 'errors': 0, 'latency': []}
+
+    async def Fetch(self, session, route):
+        """ Makes one request for 'route'.  Returns False if nothing changed """
+        await self._bucket.Take()
+        params = {'key': self._key, 'rt': route, 'outputType': 'JSON'}
+        start = time.perf_counter()
+        async with session.get(self._url, params=params, headers=self._validators.get(route, {})) as response:
+            body = await response.read()
+        self.stats['requests'] += 1
+        self.stats['latency'].append(time.perf_counter() - start)
+        if response.status == 304:
+            self.stats['not_modified'] += 1
+            return False
+        response.raise_for_status()
+
+        validators = {}
+        if 'ETag' in response.headers:
+            validators['If-None-Match'] = response.headers['ETag']
+        if 'Last-Modified' in response.headers:
+            validators['If-Modified-Since'] = response.headers['Last-Modified']
+        self._validators[route] = validators
+
+        if self._record is not None:
+            self._Record(route, body)
+        timestamp, trains = ParsePositions(body)
+        self.snapshot.Update(route, trains, timestamp)
+        return True
+
+    def _Record(self, route, body):
+        path = os.path.join(self._record, route)
+        os.makedirs(path, exist_ok=True)
+        name = '%d-%s.json' % (time.time() * 1000, hashlib.sha1(body).hexdigest()[:8])
+        with open(os.path.join(path, name), 'wb') as fh:
+            fh.write(body)
+
+    async def PollRoute(self, session, route):
+        """ Polls one route forever, backing off exponentially on errors """
+        failures = 0
+        while True:
+            try:
+                await self.Fetch(session, route)
+                failures = 0
+                delay = self._interval
+            # ValueError, KeyError and TypeError come from bodies ParsePositions can't read
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError, TypeError) as e:
+                self.stats['errors'] += 1
+                failures += 1
+                delay = min(BACKOFF_MAX, BACKOFF * 2 ** (failures - 1)) * random.uniform(0.5, 1.5)
+                # Response errors carry the request URL, which includes the key
+                if isinstance(e, aiohttp.ClientResponseError):
+                    reason = 'HTTP %d' % e.status
+                elif isinstance(e, (KeyError, TypeError)):
+                    reason = 'unexpected response (%s: %s)' % (type(e).__name__, e)
+                else:
+                    reason = e
+                log.warning("%s: %s, retrying in %.1fs", route, reason, delay)
+            await asyncio.sleep(delay)
+
+    async def Run(self, duration=None):
+        """ Polls all routes concurrently for 'duration' seconds (forever if None) """
+        connector = aiohttp.TCPConnector(limit=len(self._routes), keepalive_timeout=60)
+        timeout = aiohttp.ClientTimeout(total=30)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            tasks = [asyncio.create_task(self.PollRoute(session, r)) for r in self._routes]
+            try:
+                await asyncio.wait_for(asyncio.gather(*tasks), duration)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    def Summary(self):
+        """ Returns request counters and latency percentiles in ms """
+        latency = sorted(self.stats['latency'])
+        summary = {k: v for k, v in self.stats.items() if k != 'latency'}
+        if latency:
+            summary['latency_p50_ms'] = statistics.median(latency) * 1000
+            summary['latency_p95_ms'] = latency[int(0.95 * (len(latency) - 1))] * 1000
+        summary['trains'] = len(self.snapshot.Trains())
+        return summary
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Poll CTA Train Tracker positions')
+    parser.add_argument('--key', help='API key (default: TRAIN_TRACKER_KEY from creds.py)')
+    parser.add_argument('--url', default=API_URL, help='positions endpoint (default: %(default)s)')
+    parser.add_argument('--stations', help='station export (JSON or compact) to key the snapshot by')
+    parser.add_argument('--rate', type=float, default=RATE, help='requests per second (default: %(default)s)')
+    parser.add_argument('--interval', type=float, default=INTERVAL,
+                        help='seconds between polls of a route (default: %(default)s)')
+    parser.add_argument('--duration', type=float, help='stop after this many seconds')
+    parser.add_argument('--record', help='save every response under this directory')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    key = args.key
+    if key is None:
+        import creds
+        key = creds.TRAIN_TRACKER_KEY
+    snapshot = None
+    if args.stations:
+        import station_model
+        snapshot = Snapshot.FromStations(station_model.read_stations(args.stations))
+
+    poller = Poller(key, snapshot=snapshot, url=args.url, rate=args.rate, interval=args.interval,
+                    record=args.record)
+    try:
+        asyncio.run(poller.Run(args.duration))
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(poller.Summary()))